@@ -1,12 +1,62 @@
-from tet10 import Tet10
-from numpy import zeros
-from scipy.sparse import csr_matrix
+from tet10 import Tet10Batch
+from profiling import stage
+from meshQuality import checkMesh
+from numpy import arange, asarray, bincount, concatenate, empty, int32, int64, unique, zeros
+from scipy.sparse import coo_matrix
+
+def elementDOFs(nodes, DOFS=3):
+	"""
+	Global DOF numbers of every element (nex30) from a 0-based node connectivity (nex10), in the node-wise order used by Tet10.
+	"""
+
+	nodes = asarray(nodes)
+	dtype = int32 if DOFS*(int(nodes.max(initial=0)) + 1) < 2**31 else int64
+	return (DOFS*nodes.astype(dtype)[:, :, None] + arange(DOFS, dtype=dtype)).reshape(len(nodes), -1)
+
+def assembleStiffness(nodes, coords, properties, DOFS=3):
+	"""
+	Sparse assembly of the global stiffness matrix and force vector from triplets.
+
+	Inputs: nodes - 0-based node connectivity (nex10).
+			coords - nodal coordinates (Nnodesx3).
+			properties - dictionary of material properties.
+
+	Outputs: K - global stiffness matrix (CSR).
+			 F - global force vector.
+			 volume - total volume.
+	"""
+
+	nodes = asarray(nodes)
+	ndof = DOFS*len(coords)
+	with stage("integration", elements=len(nodes)):
+		ke, fe, vol = Tet10Batch(asarray(coords, dtype=float)[nodes], properties)
+
+	# ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+	# Row/column/value triplets (900 per element) are allocated once and summed into CSR in one step.
+	with stage("scatter"):
+		d = elementDOFs(nodes, DOFS)
+		ne, nd = d.shape
+		rows, cols = empty((ne, nd, nd), dtype=d.dtype), empty((ne, nd, nd), dtype=d.dtype)
+		rows[...] = d[:, :, None]
+		cols[...] = d[:, None, :]
+		F = bincount(d.ravel(), weights=fe.ravel(), minlength=ndof)
+
+	with stage("csr conversion") as counters:
+		K = coo_matrix((ke.ravel(), (rows.ravel(), cols.ravel())), shape=(ndof, ndof)).tocsr()
+		counters["nnz"] = K.nnz
+
+	return (K, F, vol.sum())
 
 def accessMesh(model, mesh, entities, nodeTags, physicalTags, properties, Nelements, DOFS=3):
 	fixed_tag, load_tag, body_tag = physicalTags["fixed"], physicalTags["load"], physicalTags["body"]
-	K, F = zeros((DOFS*len(nodeTags), DOFS*len(nodeTags))), zeros(DOFS*len(nodeTags))
-	Restricted_DOF, Loaded_DOF, volumen = [], [], 0
+	Restricted_DOF, Loaded_DOF = [], []
 	conections, XYZ = zeros((Nelements, 10)), {}
+	bodyTags, bodyNodes = [], []
+
+	allTags, allCoords, _ = mesh.getNodes(-1, -1)
+	coords = zeros((max(int(max(allTags)), len(nodeTags)), 3))
+	coords[asarray(allTags, dtype=int64) - 1] = asarray(allCoords).reshape(-1, 3)
 
 	for ent in entities:
 		dim, tag = ent[0], ent[1]
@@ -28,31 +78,22 @@ def accessMesh(model, mesh, entities, nodeTags, physicalTags, properties, Neleme
 				ni = 3*(int(ni)-1)
 				Loaded_DOF.append(ni+1)
 
-		if physicalTags[0] == body_tag:			
-			for e in range(len(elemTags[0])):
-				eleTag = elemTags[0][e]
-				_, nodes, _, _ = mesh.getElement(eleTag)
-				xyz = zeros((len(nodes), DOFS))
-				for i, n in enumerate(nodes):
-					coord, _, _, _ = mesh.get_node(n)
-					xyz[i] = coord
-					XYZ[3*(int(n)-1)] = coord
-
-				n1, n2, n3, n4, n5, n6, n7, n8, n9, n10 = [3*(int(ni)-1) for ni in nodes]
-
-				ke, fe, vol = Tet10(xyz, properties)
-				volumen += vol
-
-				conections[int(eleTag-1), :] = [n1, n2, n3, n4, n5, n6, n7, n8, n9, n10]
-
-				d = [n1, n1+1, n1+2, n2, n2+1, n2+2, n3, n3+1, n3+2, n4, n4+1, n4+2, n5, n5+1, n5+2,
-					 n6, n6+1, n6+2, n7, n7+1, n7+2, n8, n8+1, n8+2, n9, n9+1, n9+2, n10, n10+1, n10+2]
-				
-				for i in range(len(d)):
-					p = d[i]
-					for j in range(len(d)):
-						q = d[j]
-						K[p, q] += ke[i, j]
-					F[p] += fe[i]
-
-	return(csr_matrix(K), F, Loaded_DOF, Restricted_DOF, conections, XYZ, volumen)
\ No newline at end of file
+		if physicalTags[0] == body_tag:
+			bodyTags.append(asarray(elemTags[0], dtype=int64))
+			bodyNodes.append(asarray(elemNodeTags[0], dtype=int64).reshape(-1, 10) - 1)
+
+	# ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+	nodes = concatenate(bodyNodes) if bodyNodes else zeros((0, 10), dtype=int64)
+	for eleTags, eleNodes in zip(bodyTags, bodyNodes):
+		conections[eleTags - 1] = DOFS*eleNodes
+
+	for n in unique(nodes):
+		XYZ[DOFS*int(n)] = coords[n]
+
+	# Tet10Batch does not validate the elements: inverted ones are reordered for the assembly only (conections keeps the node
+	# order of the file, which the stresses are reported in) and invalid ones raise a ValueError.
+	nodes, _ = checkMesh(nodes, coords)
+	K, F, volumen = assembleStiffness(nodes, coords, properties, DOFS)
+
+	return(K, F, Loaded_DOF, Restricted_DOF, conections, XYZ, volumen)
@@ -0,0 +1,123 @@
+import sys
+import json
+import argparse
+import platform
+import resource
+import tracemalloc
+from time import perf_counter, process_time
+from numpy import arange
+from boxMesh import boxMesh
+from readMesh import defaultPhysicalTags, boundaryDOFs
+from accessMesh import assembleStiffness
+from symmetric import assembleUpper
+from getDisplacements import deformedShape
+from getStress import stressField
+
+# Material of the cantilever example (Steel ASTM A36 under self weight).
+properties = {"E": 200_000e6, "nu": 0.3, "bx": 0, "by": -7850*9.8, "bz": 0}
+
+def measure(function, *args, **kwargs):
+	"""
+	Runs function and returns its result with the wall time, the CPU time and the peak of traced (NumPy/Python) memory.
+	"""
+
+	tracemalloc.start()
+	wall, cpu = perf_counter(), process_time()
+	result = function(*args, **kwargs)
+	wall, cpu = perf_counter() - wall, process_time() - cpu
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return result, {"wall": wall, "cpu": cpu, "peak_bytes": peak}
+
+def cantileverDeflection(properties, size=(10, 1, 1)):
+	"""
+	Tip deflection of a cantilever under its own weight (-Y), bending (q L^4 / 8 E I) plus Timoshenko shear (q L^2 / 2 κ G A).
+	"""
+
+	L, h, b = size[0], size[1], size[2]
+	E, ν, q = properties["E"], properties["nu"], -properties["by"]*h*b
+	I, G, κ = b*h**3/12, E/(2*(1 + ν)), 5/6
+	return -(q*L**4/(8*E*I) + q*L**2/(2*κ*G*h*b))
+
+def run(n, solver="direct", size=(10, 1, 1)):
+	"""
+	Benchmarks every stage on a box of (10n x n x n) cells (60 n^3 elements). The "cholesky" solver assembles and factors
+	only the upper triangle of K.
+	"""
+
+	stages = {}
+	mesh, stages["mesh"] = measure(boxMesh, 10*n, n, n, size)
+	physicalTags = defaultPhysicalTags(mesh)
+	Restricted_DOF, Loaded_DOF = boundaryDOFs(mesh, physicalTags)
+
+	symmetric = solver == "cholesky"
+	assemble = assembleUpper if symmetric else assembleStiffness
+	(K, F, volume), stages["assembly"] = measure(assemble, mesh["elements"], mesh["coords"], properties)
+	nodeTags, info = arange(1, len(mesh["coords"]) + 1), {}
+	U, stages["solve"] = measure(deformedShape, Restricted_DOF, Loaded_DOF, nodeTags, F, K, 0, solver=solver, info=info,
+								 symmetric=symmetric)
+	_, stages["stress"] = measure(stressField, mesh["elements"], U, mesh["coords"], properties)
+
+	# Mean Y displacement of the free end against the beam theory value.
+	tip = mesh["coords"][:, 0] > size[0] - 1e-9*size[0]
+	deflection, reference = U[1::3][tip].mean(), cantileverDeflection(properties, size)
+
+	return {"n": n, "elements": len(mesh["elements"]), "nodes": len(mesh["coords"]), "nnz": K.nnz, "solver": solver,
+			"matrix_bytes": K.data.nbytes + K.indices.nbytes + K.indptr.nbytes, "factor_bytes": info.get("factor_bytes"),
+			"stages": stages, "deflection": deflection, "analytical": reference, "error": abs(deflection/reference - 1)}
+
+def compare(report, baseline, tolerance):
+	"""
+	Stages that are slower than the baseline by more than tolerance (relative), for the sizes present in both.
+	"""
+
+	previous = {(r["n"], r["solver"]): r for r in baseline["results"]}
+	regressions = []
+	for r in report["results"]:
+		old = previous.get((r["n"], r["solver"]))
+		if old is None:
+			continue
+		for stage, values in r["stages"].items():
+			before = old["stages"].get(stage, {}).get("wall")
+			if before and values["wall"] > (1 + tolerance)*before:
+				regressions.append({"n": r["n"], "stage": stage, "wall": values["wall"], "baseline": before})
+	return regressions
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Scaling benchmark of the Tet10 pipeline on structured box meshes.")
+	parser.add_argument("--sizes", default="1,2,3,4", help="Comma separated values of n, the box has 10n x n x n cells.")
+	parser.add_argument("--solver", default="direct", choices=("direct", "cholesky", "cg"))
+	parser.add_argument("--report", default="benchmark.json", help="JSON report written at the end.")
+	parser.add_argument("--baseline", help="Previous report to check for regressions.")
+	parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown against the baseline.")
+	parser.add_argument("--max-error", type=float, default=0.05, help="Allowed relative error of the tip deflection.")
+	args = parser.parse_args(argv)
+
+	results = []
+	for n in (int(s) for s in args.sizes.split(",")):
+		r = run(n, args.solver)
+		results.append(r)
+		print(f"n = {n:3d} | {r['elements']:9d} elements | " +
+			  " | ".join(f"{k} {v['wall']:8.3f} s" for k, v in r["stages"].items()) + f" | error {100*r['error']:.2f} %")
+
+	report = {"python": platform.python_version(), "machine": platform.machine(),
+			  "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, "results": results}
+
+	failed = [r["n"] for r in results if r["error"] > args.max_error]
+	report["correctness_failures"] = failed
+	if args.baseline:
+		with open(args.baseline) as file:
+			report["regressions"] = compare(report, json.load(file), args.tolerance)
+
+	with open(args.report, "w") as file:
+		json.dump(report, file, indent=1)
+
+	for r in report.get("regressions", []):
+		print(f"REGRESSION: n = {r['n']}, {r['stage']} took {r['wall']:.3f} s (baseline {r['baseline']:.3f} s)")
+	for n in failed:
+		print(f"WRONG RESULT: n = {n}, tip deflection differs from beam theory by more than {100*args.max_error:.1f} %")
+
+	return 1 if failed or report.get("regressions") else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,63 @@
+from itertools import permutations
+from numpy import arange, array, concatenate, indices, int32, int64, linspace, meshgrid, stack, unique
+
+# Gmsh/Tet10 edge of every midside node: 5 (1-2), 6 (2-3), 7 (3-1), 8 (1-4), 9 (3-4) and 10 (2-4), the 9/10 pair being the
+# one Tet10 treats as swapped.
+Edges = ((0, 1), (1, 2), (2, 0), (0, 3), (2, 3), (1, 3))
+
+def _kuhnTets():
+	"""
+	Corner offsets of the six tetrahedra that split a unit cube along its main diagonal, positively oriented.
+	"""
+
+	tets = []
+	for p in permutations(range(3)):
+		v = [array([0, 0, 0])]
+		for axis in p:
+			v.append(v[-1] + (arange(3) == axis))
+		a, b, c = v[1] - v[0], v[2] - v[0], v[3] - v[0]
+		if (a[0]*(b[1]*c[2] - b[2]*c[1]) - a[1]*(b[0]*c[2] - b[2]*c[0]) + a[2]*(b[0]*c[1] - b[1]*c[0])) < 0:
+			v[1], v[2] = v[2], v[1]
+		tets.append(v)
+	return array(tets)
+
+def boxMesh(nx, ny, nz, size=(10, 1, 1)):
+	"""
+	Structured 10-node tetrahedral mesh of a box [0, Lx]x[0, Ly]x[0, Lz], without gmsh.
+
+	Inputs: nx, ny, nz - number of cells along each axis (every cell is split in 6 tetrahedra).
+			size - dimensions of the box.
+
+	Outputs: dictionary with the same entries as readMsh, and the physical groups of cantileverBeam.geo:
+			 13 - fixed face (x = 0), 14 - loaded edge (x = Lx, y = Ly), 15 - body.
+	"""
+
+	# The quadratic nodes are the points of a grid twice as fine, so every midside node is shared automatically.
+	n = array([2*nx + 1, 2*ny + 1, 2*nz + 1])
+	x, y, z = meshgrid(linspace(0, size[0], n[0]), linspace(0, size[1], n[1]), linspace(0, size[2], n[2]), indexing="ij")
+	coords = stack([x.ravel(), y.ravel(), z.ravel()], axis=1)
+
+	def node(ijk):
+		return (ijk[..., 0]*n[1] + ijk[..., 1])*n[2] + ijk[..., 2]
+
+	# ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+	cells = 2*indices((nx, ny, nz)).reshape(3, -1).T
+	corners = 2*_kuhnTets()
+	tets = cells[:, None, None, :] + corners[None]
+	tets = tets.reshape(-1, 4, 3)
+
+	mid = stack([(tets[:, a] + tets[:, b])//2 for a, b in Edges], axis=1)
+	elements = node(concatenate([tets, mid], axis=1).astype(int64)).astype(int32)
+
+	# ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+	eps = 1e-9*max(size)
+	fixed = unique(elements[coords[elements][..., 0] < eps])
+	loaded = unique(elements[(coords[elements][..., 0] > size[0] - eps) & (coords[elements][..., 1] > size[1] - eps)])
+
+	return {"coords": coords, "elements": elements, "elementTags": arange(1, len(elements) + 1),
+			"groups": {(2, 13): fixed.astype(int32), (1, 14): loaded.astype(int32), (3, 15): unique(elements)},
+			"elementGroups": {(3, 15): arange(len(elements))},
+			"physicalGroups": [(1, 14), (2, 13), (3, 15)],
+			"physicalNames": {(1, 14): "fuerza", (2, 13): "empotrado", (3, 15): "body"}}
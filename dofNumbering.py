@@ -0,0 +1,87 @@
+from tet10 import Tet10Batch
+from profiling import stage
+from accessMesh import elementDOFs
+from numpy import arange, asarray, bincount, broadcast_to, full, int64, ones, unique
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import reverse_cuthill_mckee
+
+def renumberNodes(nodes, Nnodes):
+	"""
+	Reverse Cuthill-McKee order of the nodes (old node indices, in their new order), from the element connectivity graph.
+	"""
+
+	nodes = asarray(nodes, dtype=int64)
+	rows = broadcast_to(nodes[:, :, None], nodes.shape + (nodes.shape[1],)).ravel()
+	cols = broadcast_to(nodes[:, None, :], nodes.shape + (nodes.shape[1],)).ravel()
+	graph = coo_matrix((ones(len(rows), dtype=bool), (rows, cols)), shape=(Nnodes, Nnodes)).tocsr()
+	return reverse_cuthill_mckee(graph, symmetric_mode=True).astype(int64)
+
+def equationNumbering(Nnodes, Restricted_DOF, order=None, DOFS=3):
+	"""
+	Equation numbers of the free DOFs.
+
+	Inputs: Nnodes - number of nodes.
+			Restricted_DOF - constrained DOFs (duplicates are allowed, e.g. one entry per surface element).
+			order - node order of the equations (renumberNodes), the natural order if None.
+
+	Outputs: free_dof - global DOF of every equation, in equation order.
+			 Restricted_DOF - sorted constrained DOFs without duplicates.
+			 eq - equation of every global DOF (-1 for constrained DOFs).
+	"""
+
+	ndof = DOFS*Nnodes
+	Restricted_DOF = unique(asarray(Restricted_DOF, dtype=int64).ravel())
+	order = arange(Nnodes) if order is None else asarray(order, dtype=int64)
+
+	dofs = (DOFS*order[:, None] + arange(DOFS)).ravel()
+	constrained = full(ndof, False)
+	constrained[Restricted_DOF] = True
+	free_dof = dofs[~constrained[dofs]]
+
+	eq = full(ndof, -1, dtype=int64)
+	eq[free_dof] = arange(len(free_dof))
+	return (free_dof, Restricted_DOF, eq)
+
+def assembleReduced(nodes, coords, properties, Restricted_DOF, renumber=True, DOFS=3):
+	"""
+	Assembles Kff and Kfc directly, without forming the full K nor slicing it.
+
+	Inputs: nodes - 0-based node connectivity (nex10).
+			coords - nodal coordinates (Nnodesx3).
+			properties - dictionary of material properties.
+			Restricted_DOF - constrained DOFs.
+			renumber - order the equations with reverse Cuthill-McKee to reduce the fill-in of the factorization.
+
+	Outputs: Kff - stiffness of the free DOFs (CSR, equation numbering).
+			 Kfc - coupling between free and constrained DOFs (CSR).
+			 F - global force vector (global numbering, 3*(nodeTag-1)).
+			 free_dof - global DOF of every equation, U[free_dof] = solution maps the result back to the node tags.
+			 Restricted_DOF - constrained DOFs without duplicates, in the column order of Kfc.
+			 volume - total volume.
+	"""
+
+	nodes, Nnodes = asarray(nodes), len(coords)
+	order = renumberNodes(nodes, Nnodes) if renumber else None
+	free_dof, Restricted_DOF, eq = equationNumbering(Nnodes, Restricted_DOF, order, DOFS)
+	ceq = full(DOFS*Nnodes, -1, dtype=int64)
+	ceq[Restricted_DOF] = arange(len(Restricted_DOF))
+
+	with stage("integration", elements=len(nodes)):
+		ke, fe, vol = Tet10Batch(asarray(coords, dtype=float)[nodes], properties)
+
+	with stage("scatter"):
+		d = elementDOFs(nodes, DOFS)
+		F = bincount(d.ravel(), weights=fe.ravel(), minlength=DOFS*Nnodes)
+		rows, cols, ccols = eq[d][:, :, None], eq[d][:, None, :], ceq[d][:, None, :]
+		ff = (rows >= 0) & (cols >= 0)
+		fc = (rows >= 0) & (ccols >= 0)
+
+	with stage("csr conversion") as counters:
+		shape = ke.shape
+		Kff = coo_matrix((ke[ff], (broadcast_to(rows, shape)[ff], broadcast_to(cols, shape)[ff])),
+						 shape=(len(free_dof), len(free_dof))).tocsr()
+		Kfc = coo_matrix((ke[fc], (broadcast_to(rows, shape)[fc], broadcast_to(ccols, shape)[fc])),
+						 shape=(len(free_dof), len(Restricted_DOF))).tocsr()
+		counters["nnz"] = Kff.nnz
+
+	return (Kff, Kfc, F, free_dof, Restricted_DOF, vol.sum())
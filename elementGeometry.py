@@ -0,0 +1,110 @@
+from tet10 import Gauss_rule, Natural_coords, referenceShapeFunctions, jacobianDeterminant, shapeGradients, gradientsToB, gradientsToStrain
+from accessMesh import elementDOFs
+from numpy import array, asarray, bincount, broadcast_to, diag, einsum, empty, float64, zeros
+from scipy.sparse import coo_matrix, csr_matrix
+
+# Isotropic split of the stress-strain matrix of Tet10: E_ = λ Dλ + μ Dμ (engineering shear strains).
+Dλ = zeros((6, 6))
+Dλ[:3, :3] = 1
+Dμ = diag([2., 2., 2., 1., 1., 1.])
+
+def lameParameters(properties):
+	"""
+	Lamé parameters (λ, μ) of the E and nu entries of the material properties.
+	"""
+
+	E, ν = properties["E"], properties["nu"]
+	return (E*ν/((1 + ν)*(1 - 2*ν)), E/(2*(1 + ν)))
+
+def elementGeometry(nodes, coords, dtype=float64, chunk=50000):
+	"""
+	Material independent geometry of every element, computed once and shared by assembly and stress recovery.
+
+	Inputs: nodes - 0-based node connectivity (nex10).
+			coords - nodal coordinates (Nnodesx3).
+			dtype - storage type (float32 halves the store).
+
+	Outputs: dictionary with
+			 wJ - Gauss weight times det(J) at the Gauss points (nex4).
+			 q - shape function derivatives at the Gauss points (nex4x10x3).
+			 qNodes - shape function derivatives at the nodes (nex10x10x3).
+			 weights - body force weight of every element node (nex10), fe = weights*b.
+	"""
+
+	nodes, coords = asarray(nodes), asarray(coords, dtype=float)
+	w = array([g[0] for g in Gauss_rule])
+	N, dN = referenceShapeFunctions([g[1:] for g in Gauss_rule])
+	_, dNn = referenceShapeFunctions(Natural_coords)
+
+	ne, ng = len(nodes), len(Gauss_rule)
+	g = {"wJ": empty((ne, ng), dtype=dtype), "q": empty((ne, ng, 10, 3), dtype=dtype),
+		 "qNodes": empty((ne, 10, 10, 3), dtype=dtype), "weights": empty((ne, 10), dtype=dtype)}
+
+	for start in range(0, ne, chunk):
+		s = slice(start, start + chunk)
+		xyz = coords[nodes[s]]
+		det_J = jacobianDeterminant(xyz, dN)
+		g["wJ"][s] = w*det_J
+		g["q"][s] = shapeGradients(xyz, dN, det_J)
+		g["qNodes"][s] = shapeGradients(xyz, dNn, jacobianDeterminant(xyz, dNn))
+		g["weights"][s] = (w*det_J) @ N
+
+	return g
+
+def stiffnessBasis(geometry, nodes, Nnodes, chunk=20000, DOFS=3):
+	"""
+	Global matrices Kλ and Kμ (CSR, same sparsity pattern) such that K = λ Kλ + μ Kμ for any isotropic material.
+	"""
+
+	nodes = asarray(nodes)
+	ne, ndof = len(nodes), DOFS*Nnodes
+	Kλe, Kμe = empty((ne, 30, 30)), empty((ne, 30, 30))
+
+	for start in range(0, ne, chunk):
+		s = slice(start, start + chunk)
+		B = gradientsToB(asarray(geometry["q"][s], dtype=float))
+		wJ = asarray(geometry["wJ"][s], dtype=float)[..., None, None]
+		Kλe[s] = einsum("egia,egib->eab", B, (Dλ @ B)*wJ)
+		Kμe[s] = einsum("egia,egib->eab", B, (Dμ @ B)*wJ)
+
+	d = elementDOFs(nodes, DOFS)
+	rows = broadcast_to(d[:, :, None], (ne, 30, 30)).ravel()
+	cols = broadcast_to(d[:, None, :], (ne, 30, 30)).ravel()
+
+	# Both matrices come from the same triplet indices, tocsr keeps explicit zeros, so their patterns are identical.
+	Kλ = coo_matrix((Kλe.ravel(), (rows, cols)), shape=(ndof, ndof)).tocsr()
+	Kμ = coo_matrix((Kμe.ravel(), (rows, cols)), shape=(ndof, ndof)).tocsr()
+	return (Kλ, Kμ)
+
+def combineStiffness(basis, properties):
+	"""
+	Stiffness matrix of a new material from the basis, an O(nnz) recombination without re-integration.
+	"""
+
+	Kλ, Kμ = basis
+	λ, μ = lameParameters(properties)
+	return csr_matrix((λ*Kλ.data + μ*Kμ.data, Kλ.indices, Kλ.indptr), shape=Kλ.shape)
+
+def bodyForce(geometry, nodes, Nnodes, properties, DOFS=3):
+	"""
+	Global force vector of the body force (bx, by, bz) from the stored weights.
+	"""
+
+	w = bincount(asarray(nodes).ravel(), weights=asarray(geometry["weights"], dtype=float).ravel(), minlength=Nnodes)
+	b = array([properties["bx"], properties["by"], properties["bz"]], dtype=float)
+	return (w[:, None]*b).ravel()
+
+def strainsFromGeometry(geometry, nodes, U, chunk=50000, DOFS=3):
+	"""
+	Strains at the nodes (nex10x6[xncases]) from the stored nodal derivatives. They do not depend on the material, the
+	stresses follow with elasticityMatrix(properties).
+	"""
+
+	nodes, U = asarray(nodes), asarray(U)
+	Un = U.reshape((-1, DOFS) + U.shape[1:])
+	ε = empty((len(nodes), 10, 6) + U.shape[1:])
+	for start in range(0, len(nodes), chunk):
+		e = nodes[start:start + chunk]
+		ue = Un[e].reshape((len(e), 10*DOFS) + U.shape[1:])
+		ε[start:start + chunk] = gradientsToStrain(asarray(geometry["qNodes"][start:start + chunk], dtype=float), ue)
+	return ε
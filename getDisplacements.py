@@ -1,7 +1,31 @@
-from scipy.sparse.linalg import spsolve
-from numpy import zeros, arange, array, setdiff1d, ix_
+from time import perf_counter
+from scipy.sparse.linalg import splu, LinearOperator
+from profiling import stage
+from numpy import zeros, arange, array, setdiff1d, unique, ix_
+from solvers import pcg, jacobiPreconditioner, blockJacobiPreconditioner
+from matrixFree import RestrictedOperator
+from symmetric import SymmetricOperator, SymmetricFactorization, symmetricBlocks
+from scipy.sparse import triu
+
+Preconditioners = {"none": None,
+				   "jacobi": jacobiPreconditioner,
+				   "block-jacobi": blockJacobiPreconditioner}
+
+def deformedShape(Restricted_DOF, Loaded_DOF, NodeTags, F, K, f, DOFS=3, solver="direct", preconditioner="jacobi", tol=1e-8, maxiter=None, U0=None, info=None, reduced=None, symmetric=False):
+	"""
+	Solves K U = F for the free DOFs. K may be a sparse matrix or a matrix-free LinearOperator (Tet10Operator), the latter
+	only with solver="cg".
+
+	solver - "direct" (sparse LU, default), "cholesky" (SymmetricFactorization: banded Cholesky in reverse Cuthill-McKee order,
+			 symmetric SuperLU when the band is too wide) or "cg" (preconditioned conjugate gradient).
+	preconditioner - "none", "jacobi", "block-jacobi" (DOFSxDOFS nodal blocks), only used by "cg".
+	tol, maxiter - relative residual tolerance and iteration cap of "cg".
+	U0 - previous displacement field used as the initial guess of "cg".
+	info - optional dictionary that receives the solver report (iterations, residual history and wall time).
+	reduced - (Kff, Kfc, free_dof, Restricted_DOF) from assembleReduced, used instead of slicing K (K may then be None).
+	symmetric - K only holds its upper triangle (assembleUpper).
+	"""
 
-def deformedShape(Restricted_DOF, Loaded_DOF, NodeTags, F, K, f, DOFS=3):
 	U = zeros(DOFS*len(NodeTags))
 	Restricted_DOF = array(Restricted_DOF).flatten()
 	Loaded_DOF = set(Loaded_DOF)
@@ -9,21 +33,60 @@ def deformedShape(Restricted_DOF, Loaded_DOF, NodeTags, F, K, f, DOFS=3):
 	for ni in Loaded_DOF:
 		F[ni] += f
 
-	free_dof = arange(DOFS*len(NodeTags))
-	Restricted_DOF = array(Restricted_DOF)
-	free_dof = setdiff1d(free_dof, Restricted_DOF)
+	# Fixed face nodes are listed once per surface element, duplicates are removed before slicing.
+	Restricted_DOF = unique(Restricted_DOF)
+	free_dof = setdiff1d(arange(DOFS*len(NodeTags)), Restricted_DOF)
+
+	with stage("boundary conditions", dofs=len(free_dof)):
+		if reduced is not None:
+			Kff, Kfc, free_dof, Restricted_DOF = reduced
+		# A matrix-free K (LinearOperator) cannot be sliced, its blocks are applied through the full operator instead.
+		elif isinstance(K, LinearOperator):
+			assert solver == "cg" and preconditioner in ("none", "jacobi"), "Matrix-free K needs solver='cg' with the 'none' or 'jacobi' preconditioner!"
+			Kff = RestrictedOperator(K, free_dof, free_dof)
+			Kfc = RestrictedOperator(K, free_dof, Restricted_DOF)
+		elif symmetric:
+			Kff, Kfc = symmetricBlocks(K, free_dof, Restricted_DOF)
+		else:
+			Kff = K[ix_(free_dof, free_dof)]
+			Kfc = K[ix_(free_dof, Restricted_DOF)]
 
-	Kff = K[ix_(free_dof, free_dof)]
-	Kfc = K[ix_(free_dof, Restricted_DOF)]
-	kcf = Kfc.T
-	Kcc = K[ix_(Restricted_DOF, Restricted_DOF)]
+		ff = F[free_dof]
+		uc = U[Restricted_DOF]
 
-	ff = F[free_dof]
-	fc = F[Restricted_DOF]
+	with stage("solve", solver=solver) as counters:
+		start = perf_counter()
+		if solver == "direct":
+			# Same SuperLU factorization as spsolve, kept explicit so that the fill-in can be reported. The equations of a reduced
+			# system are already in a bandwidth-reducing order, which SuperLU's own column ordering would only spoil.
+			A = Kff + triu(Kff, 1).T if symmetric else Kff
+			lu = splu(A.tocsc(), permc_spec="NATURAL" if reduced is not None else "COLAMD")
+			UF = lu.solve(ff - Kfc @ uc)
+			report = {"iterations": 0, "residuals": [], "converged": True, "fill_in": (lu.L.nnz + lu.U.nnz)/A.nnz,
+					  "factor_bytes": sum(M.data.nbytes + M.indices.nbytes + M.indptr.nbytes for M in (lu.L, lu.U))}
+		elif solver == "cholesky":
+			R = SymmetricFactorization(Kff if symmetric else triu(Kff, format="csr"))
+			UF = R.solve(ff - Kfc @ uc)
+			report = {"iterations": 0, "residuals": [], "converged": True, "method": R.method, "bandwidth": R.bandwidth,
+					  "factor_bytes": R.nbytes()}
+		elif solver == "cg":
+			M = Preconditioners[preconditioner]
+			# The half-stored matrix is applied through U x + U^T x - D x, the nodal block preconditioner needs it whole.
+			A = Kff + triu(Kff, 1).T if symmetric and M is blockJacobiPreconditioner else Kff
+			if symmetric:
+				Kff = SymmetricOperator(Kff)
+			if M is blockJacobiPreconditioner:
+				M = M(A, free_dof, DOFS)
+			elif M is not None:
+				M = M(A)
+			x0 = None if U0 is None else U0[free_dof]
+			UF, report = pcg(Kff, ff - Kfc @ uc, M=M, x0=x0, tol=tol, maxiter=maxiter)
+		else:
+			raise ValueError(f"Unknown solver '{solver}'!")
 
-	uf = U[free_dof]
-	uc = U[Restricted_DOF]
+		counters.update({k: v for k, v in report.items() if k != "residuals"})
+		if info is not None:
+			info.update(report, solver=solver, time=perf_counter() - start)
 
-	UF = spsolve(Kff, ff - Kfc @ uc)
 	U[free_dof] = UF
 	return (U)
@@ -1,38 +1,65 @@
-from tet10 import Tet10
-from numpy import array, zeros
+from tet10 import Tet10StrainBatch, elasticityMatrix
+from elementGeometry import strainsFromGeometry
+from profiling import stage
+from numpy import asarray, einsum, empty, float64, int64, sqrt, zeros
+
+def stressField(nodes, U, coords, properties, dtype=float64, chunk=50000, DOFS=3, geometry=None):
+	"""
+	Vectorized stress/strain recovery at the nodes of every element.
+
+	Inputs: nodes - 0-based node connectivity (nex10).
+			U - displacements (3N), or (3Nxncases) for several load cases.
+			coords - nodal coordinates (Nnodesx3).
+			properties - dictionary of material properties.
+			dtype - type of the returned arrays (float32 halves their size).
+			chunk - number of elements processed at once.
+			geometry - element geometry store (elementGeometry), reused instead of recomputing the Jacobians.
+
+	Outputs: ε - strains (nex10x6[xncases]), with engineering shear strains (γxy, γyz, γzx).
+			 σ - stresses (nex10x6[xncases]), ordered σx, σy, σz, σxy, σyz, σzx.
+	"""
+
+	nodes, U, coords = asarray(nodes), asarray(U), asarray(coords, dtype=float)
+	Un = U.reshape((-1, DOFS) + U.shape[1:])
+	ε = empty((len(nodes), 10, 6) + U.shape[1:], dtype=dtype)
+	σ = empty((len(nodes), 10, 6) + U.shape[1:], dtype=dtype)
+
+	with stage("stress recovery", elements=len(nodes)):
+		if geometry is not None:
+			ε[...] = strainsFromGeometry(geometry, nodes, U, chunk, DOFS)
+			σ[...] = einsum("ij,epj...->epi...", elasticityMatrix(properties), ε)
+			return (ε, σ)
+
+		for start in range(0, len(nodes), chunk):
+			e = nodes[start:start + chunk]
+			ue = Un[e].reshape((len(e), 10*DOFS) + U.shape[1:])
+			ε[start:start + chunk], σ[start:start + chunk] = Tet10StrainBatch(coords[e], properties, ue)
+
+	return (ε, σ)
+
+def vonMises(σ):
+	"""
+	Von Mises equivalent stress from a stress array whose third axis holds σx, σy, σz, σxy, σyz, σzx.
+	"""
+
+	σx, σy, σz, σxy, σyz, σzx = (σ[:, :, i] for i in range(6))
+	return sqrt(0.5*((σx - σy)**2 + (σy - σz)**2 + (σz - σx)**2) + 3*(σxy**2 + σyz**2 + σzx**2))
 
 def stress(conections, U, XYZ, properties, Nelements, globalEleTags):
-	σx, σy, σz = zeros((Nelements, 10)), zeros((Nelements, 10)), zeros((Nelements, 10))
-	σxy, σyz, σzx = zeros((Nelements, 10)), zeros((Nelements, 10)), zeros((Nelements, 10))
-	εx, εy, εz = zeros((Nelements, 10)), zeros((Nelements, 10)), zeros((Nelements, 10))
-	εxy, εyz, εzx = zeros((Nelements, 10)), zeros((Nelements, 10)), zeros((Nelements, 10))
-
-	for eleTag in globalEleTags:
-		n1, n2, n3, n4, n5, n6, n7, n8, n9, n10 = conections[int(eleTag-1)]
-
-		ue = array([U[int(n1)], U[int(n1+1)], U[int(n1+2)], U[int(n2)], U[int(n2+1)], U[int(n2+2)],
-					U[int(n3)], U[int(n3+1)], U[int(n3+2)], U[int(n4)], U[int(n4+1)], U[int(n4+2)],
-					U[int(n5)], U[int(n5+1)], U[int(n5+2)], U[int(n6)], U[int(n6+1)], U[int(n6+2)],
-					U[int(n7)], U[int(n7+1)], U[int(n7+2)], U[int(n8)], U[int(n8+1)], U[int(n8+2)],
-					U[int(n9)], U[int(n9+1)], U[int(n9+2)], U[int(n10)], U[int(n10+1)], U[int(n10+2)]])
-
-		xyz = array([XYZ[int(n1)], XYZ[int(n2)], XYZ[int(n3)], XYZ[int(n4)], XYZ[int(n5)],
-					 XYZ[int(n6)], XYZ[int(n7)], XYZ[int(n8)], XYZ[int(n9)], XYZ[int(n10)]])
-
-		εe, σe = Tet10(xyz, properties, ue=ue)
-
-		εx[int(eleTag-1)]  = εe[:, 0]
-		εy[int(eleTag-1)]  = εe[:, 1]
-		εz[int(eleTag-1)]  = εe[:, 2]
-		εxy[int(eleTag-1)] = 0.5*εe[:, 3]
-		εyz[int(eleTag-1)] = 0.5*εe[:, 4]
-		εzx[int(eleTag-1)] = 0.5*εe[:, 5]
-
-		σx[int(eleTag-1)]  = σe[:, 0]
-		σy[int(eleTag-1)]  = σe[:, 1]
-		σz[int(eleTag-1)]  = σe[:, 2]
-		σxy[int(eleTag-1)] = σe[:, 3]
-		σyz[int(eleTag-1)] = σe[:, 4]
-		σzx[int(eleTag-1)] = σe[:, 5]
-
-	return(εx, εy, εz, εxy, εyz, εzx, σx, σy, σz, σxy, σyz, σzx)
\ No newline at end of file
+	rows = asarray(globalEleTags, dtype=int64) - 1
+	nodes = asarray(conections)[rows].astype(int64)//3
+
+	coords = zeros((max(XYZ) // 3 + 1, 3))
+	for dof, coord in XYZ.items():
+		coords[dof//3] = coord
+
+	εe, σe = stressField(nodes, U, coords, properties)
+
+	εx, εy, εz, εxy, εyz, εzx = (zeros((Nelements, 10)) for _ in range(6))
+	σx, σy, σz, σxy, σyz, σzx = (zeros((Nelements, 10)) for _ in range(6))
+
+	for i, (εi, σi) in enumerate(zip((εx, εy, εz, εxy, εyz, εzx), (σx, σy, σz, σxy, σyz, σzx))):
+		εi[rows] = εe[:, :, i] if i < 3 else 0.5*εe[:, :, i]
+		σi[rows] = σe[:, :, i]
+
+	return(εx, εy, εz, εxy, εyz, εzx, σx, σy, σz, σxy, σyz, σzx)
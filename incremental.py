@@ -0,0 +1,232 @@
+from time import perf_counter
+from tet10 import Tet10Batch
+from accessMesh import assembleStiffness, elementDOFs
+from getStress import stressField
+from loadCases import Factorization
+from solvers import pcg, jacobiPreconditioner
+from numpy import abs as absolute, add, arange, argsort, asarray, broadcast_to, concatenate, eye, flatnonzero, full, hstack, int64, ix_, ones, repeat, setdiff1d, unique, zeros
+from numpy.linalg import solve as denseSolve
+from scipy.sparse import coo_matrix
+
+# ----------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Incremental re-analysis. The model keeps K, F, a base factorization of Kff and the last solution. Editing the material of a
+# set of elements adds their (ke_new - ke_old) straight into K.data and remembers the change ΔK. While the rank of ΔK on
+# the free DOFs stays small, solutions come from the base factorization through the Sherman-Morrison-Woodbury
+# identity (Kff + V C V^T)^-1 = A^-1 - A^-1 V (I + C V^T A^-1 V)^-1 C V^T A^-1, which never needs C to be invertible (an
+# element stiffness is singular). Newly fixed DOFs are imposed on top of it exactly, as a bordered system; releasing a DOF
+# of the base constraint set needs a new factorization.
+# ----------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+Max_rank = 2000		# Edited free DOFs above which "auto" refactorizes whatever the cost estimate, bounding the k x k matrices.
+Block = 64			# Right hand sides per triangular solve while forming the capacitance matrix.
+Ring_tol = 1e-3		# Relative stress change of the outermost ring at which stresses() stops adding rings.
+
+class IncrementalModel:
+	"""
+	Linear analysis that is updated, rather than recomputed, after local edits of the material or the constraints.
+
+	Inputs: nodes - 0-based node connectivity (nex10).
+			coords - nodal coordinates (Nnodesx3).
+			properties - dictionary of material properties of every element.
+			Restricted_DOF - constrained DOFs.
+			Loaded_DOF - DOFs that receive the point load f.
+	"""
+
+	def __init__(self, nodes, coords, properties, Restricted_DOF, Loaded_DOF, f=0, max_rank=Max_rank, DOFS=3):
+		self.nodes, self.coords, self.DOFS, self.max_rank = asarray(nodes), asarray(coords, dtype=float), DOFS, max_rank
+		ne, Nnodes = len(self.nodes), len(self.coords)
+		ndof = DOFS*Nnodes
+
+		self.materials, self.material = [dict(properties)], zeros(ne, dtype=int64)
+		self.K, self.F, _ = assembleStiffness(self.nodes, self.coords, properties, DOFS)
+		self.K.sort_indices()
+		self.F[unique(asarray(Loaded_DOF, dtype=int64))] += f
+		self.Restricted_DOF = unique(asarray(Restricted_DOF, dtype=int64).ravel())
+
+		# Sorted keys of the CSR entries (row*ndof + column) locate the entries of any element in K.data.
+		self._keys = repeat(arange(ndof, dtype=int64), self.K.indptr[1:] - self.K.indptr[:-1])*ndof + self.K.indices
+		self._nodeElements = coo_matrix((ones(self.nodes.size, dtype=bool), (self.nodes.ravel(), repeat(arange(ne), 10))),
+										shape=(Nnodes, ne)).tocsr()
+
+		self.rebase()
+		self.U = self.base.solve(self.F)
+		self.ε, self.σ = stressField(self.nodes, self.U, self.coords, properties)
+		self._stale = set()
+
+	def rebase(self):
+		"""
+		Factorizes the current Kff, after which the pending edits cost nothing at solve time. The factorization and one
+		solve are timed, they price a refactorization against the k solves of a Woodbury update in solve("auto").
+		"""
+
+		start = perf_counter()
+		self.base = Factorization(self.K, self.Restricted_DOF)
+		factorized = perf_counter()
+		self.base.lu.solve(zeros(len(self.base.free_dof)))
+		self.factor_time, self.solve_time = factorized - start, perf_counter() - factorized
+
+		self._eq = full(self.K.shape[0], -1, dtype=int64)
+		self._eq[self.base.free_dof] = arange(len(self.base.free_dof))
+		self._delta, self._update = [], None
+		self._border = (zeros(0, dtype=int64), zeros((len(self.base.free_dof), 0)))
+
+	def _elementMatrices(self, rows, material):
+		ke, fe = zeros((len(rows), 30, 30)), zeros((len(rows), 30))
+		for m in unique(material):
+			i = flatnonzero(material == m)
+			ke[i], fe[i], _ = Tet10Batch(self.coords[self.nodes[rows[i]]], self.materials[m])
+		return (ke, fe)
+
+	def updateElements(self, rows, properties):
+		"""
+		Gives a new material (properties) to the elements rows, updating K and F in place in O(len(rows)).
+		"""
+
+		rows = unique(asarray(rows, dtype=int64))
+		old_ke, old_fe = self._elementMatrices(rows, self.material[rows])
+		self.materials.append(dict(properties))
+		self.material[rows] = len(self.materials) - 1
+		new_ke, new_fe = self._elementMatrices(rows, self.material[rows])
+
+		d = elementDOFs(self.nodes[rows], self.DOFS).astype(int64)
+		ndof = self.K.shape[0]
+		r, c = broadcast_to(d[:, :, None], new_ke.shape), broadcast_to(d[:, None, :], new_ke.shape)
+		add.at(self.K.data, self._keys.searchsorted(r*ndof + c).ravel(), (new_ke - old_ke).ravel())
+		add.at(self.F, d.ravel(), (new_fe - old_fe).ravel())
+
+		self._delta.append((r.ravel(), c.ravel(), (new_ke - old_ke).ravel()))
+		self._update = None
+		self._border = (self._border[0][:0], self._border[1][:, :0])
+		self._stale.update(rows.tolist())
+
+	def fixNodes(self, nodes):
+		dofs = (self.DOFS*asarray(nodes, dtype=int64)[:, None] + arange(self.DOFS)).ravel()
+		self.Restricted_DOF = unique(concatenate([self.Restricted_DOF, dofs]))
+		self._stale.update(unique(self._nodeElements[asarray(nodes, dtype=int64)].indices).tolist())
+
+	def releaseNodes(self, nodes):
+		dofs = (self.DOFS*asarray(nodes, dtype=int64)[:, None] + arange(self.DOFS)).ravel()
+		self.Restricted_DOF = setdiff1d(self.Restricted_DOF, dofs)
+		self._stale.update(unique(self._nodeElements[asarray(nodes, dtype=int64)].indices).tolist())
+
+	def solve(self, method="auto", tol=1e-10, maxiter=None):
+		"""
+		Displacements of the edited model.
+
+		method - "woodbury" (low-rank update of the base factorization), "cg" (CG warm-started from the last solution) or
+				 "auto" (woodbury while its k solves, each priced as the timed solve of rebase, cost less than the timed
+				 factorization and k does not exceed max_rank, otherwise a new factorization).
+
+		Outputs: U - displacements (3N).
+				 report - method, rank of the update, newly fixed DOFs, estimated cost of the update and time.
+		"""
+
+		start = perf_counter()
+		if method == "cg":
+			free = setdiff1d(arange(self.K.shape[0]), self.Restricted_DOF)
+			Kff = self.K[ix_(free, free)]
+			U = zeros(self.K.shape[0])
+			U[free], report = pcg(Kff, self.F[free], M=jacobiPreconditioner(Kff), x0=self.U[free], tol=tol, maxiter=maxiter)
+			report = {"method": "cg", "iterations": report["iterations"], "converged": report["converged"]}
+			self.U = U
+			report["time"] = perf_counter() - start
+			return (U, report)
+
+		# Releasing a constraint of the base factorization, or an edit whose update costs more than factorizing again, needs a
+		# new factorization. A capacitance matrix that is already formed only costs two more solves.
+		released = len(setdiff1d(self.base.Restricted_DOF, self.Restricted_DOF)) > 0
+		D = unique(concatenate([r[self._eq[r] >= 0] for r, _, _ in self._delta])) if self._delta else zeros(0, dtype=int64)
+		estimate = len(D)*self.solve_time if self._update is None else 2*self.solve_time
+		if released or (method == "auto" and (len(D) > self.max_rank or estimate > self.factor_time)):
+			self.rebase()
+			D = zeros(0, dtype=int64)
+			method = "refactorization"
+		else:
+			method = "woodbury"
+
+		eq, lu = self._eq, self.base.lu
+		n, k = len(self.base.free_dof), len(D)
+		if k and self._update is None:
+			r, c, v = (concatenate(a) for a in zip(*self._delta))
+			inside = (eq[r] >= 0) & (eq[c] >= 0)
+			local = full(self.K.shape[0], -1, dtype=int64)
+			local[D] = arange(k)
+			C = coo_matrix((v[inside], (local[r[inside]], local[c[inside]])), shape=(k, k)).toarray()
+
+			# Only the rows D of A^-1 V are kept, computed Block columns at a time, so the memory is O(n + k^2). They are
+			# reused by later solves until the next element edit.
+			W = zeros((k, k))
+			for first in range(0, k, Block):
+				V = zeros((n, min(Block, k - first)))
+				V[eq[D[first:first + Block]], arange(V.shape[1])] = 1
+				W[:, first:first + Block] = lu.solve(V)[eq[D]]
+			self._update = (C, eye(k) + C @ W)
+		if k:
+			C, capacitance = self._update
+
+		def inverse(B):
+			X = lu.solve(B)
+			if k:
+				V = zeros(B.shape)
+				V[eq[D]] = denseSolve(capacitance, C @ X[eq[D]])
+				X -= lu.solve(V)
+			return X
+
+		# Newly fixed DOFs: u = x - G (G_EE)^-1 x_E with G = A^-1 E, the reactions being the multipliers. The columns of G are
+		# kept until the next element edit, only those of DOFs fixed since the last solve are computed.
+		E = eq[setdiff1d(self.Restricted_DOF, self.base.Restricted_DOF)]
+		x = inverse(self.F[self.base.free_dof])
+		if len(E):
+			cached, G = self._border
+			new = setdiff1d(E, cached)
+			if len(new):
+				B = zeros((n, len(new)))
+				B[new, arange(len(new))] = 1
+				cached, G = concatenate([cached, new]), hstack([G, inverse(B)])
+				order = argsort(cached)
+				cached, G = cached[order], G[:, order]
+			G = G[:, cached.searchsorted(E)]
+			self._border = (E, G)
+			x -= G @ denseSolve(G[E], x[E])
+
+		U = zeros(self.K.shape[0])
+		U[self.base.free_dof] = x
+		U[self.Restricted_DOF] = 0
+		self.U = U
+		return (U, {"method": method, "rank": k, "constraints": len(E), "estimate": estimate, "factorization": self.factor_time,
+					"time": perf_counter() - start})
+
+	def stresses(self, rings="auto", tol=Ring_tol):
+		"""
+		Recomputes the strains and stresses of the edited elements and of layers (rings) of their neighbours, from the last
+		solution.
+
+		rings - number of layers, "auto" (layers are added until the change of the outermost one, relative to the largest
+				stress, drops below tol) or None (every element).
+
+		Outputs: rows - updated elements.
+				 report - rings used and change of the outermost ring, an estimate of what is left out.
+		"""
+
+		def recompute(rows):
+			σ_old = self.σ[rows].copy()
+			for m in unique(self.material[rows]):
+				r = rows[self.material[rows] == m]
+				self.ε[r], self.σ[r] = stressField(self.nodes[r], self.U, self.coords, self.materials[m])
+			return absolute(self.σ[rows] - σ_old).max(initial=0)
+
+		σ_max = lambda: absolute(self.σ).max(initial=0) or 1
+		if rings is None:
+			recompute(arange(len(self.nodes)))
+			self._stale = set()
+			return (arange(len(self.nodes)), {"elements": len(self.nodes), "rings": None, "ring_change": 0.})
+
+		rows = asarray(sorted(self._stale), dtype=int64)
+		change, layer, count = recompute(rows)/σ_max(), rows, 0
+		while len(layer) and (count < rings if rings != "auto" else count == 0 or change >= tol):
+			layer = setdiff1d(unique(self._nodeElements[unique(self.nodes[layer])].indices), rows)
+			rows = concatenate([rows, layer])
+			change, count = recompute(layer)/σ_max(), count + 1
+		self._stale = set()
+
+		return (unique(rows), {"elements": len(rows), "rings": count, "ring_change": change})
@@ -0,0 +1,116 @@
+from hashlib import sha1
+from collections import OrderedDict
+from tet10 import Gauss_rule, referenceShapeFunctions, jacobianDeterminant
+from getStress import stressField
+from numpy import arange, array, asarray, bincount, float64, setdiff1d, unique, zeros
+from scipy.sparse.linalg import splu
+
+# Factorizations kept in the process, least recently used first.
+Cache_size = 4
+_factorizations = OrderedDict()
+
+class Factorization:
+	"""
+	Sparse LU factorization of Kff, reused for any number of right hand sides.
+	"""
+
+	def __init__(self, K, Restricted_DOF):
+		self.ndof = K.shape[0]
+		self.Restricted_DOF = unique(asarray(Restricted_DOF, dtype=int).ravel())
+		self.free_dof = setdiff1d(arange(self.ndof), self.Restricted_DOF)
+
+		K = K.tocsr()
+		self.Kfc = K[self.free_dof][:, self.Restricted_DOF]
+		self.lu = splu(K[self.free_dof][:, self.free_dof].tocsc())
+
+	def solve(self, F, uc=None):
+		"""
+		Displacements for one (3N) or several (3Nxncases) force vectors, two triangular solves per case.
+		"""
+
+		F = asarray(F, dtype=float)
+		U = zeros(F.shape)
+		rhs = F[self.free_dof]
+		if uc is not None:
+			U[self.Restricted_DOF] = uc
+			rhs = rhs - self.Kfc @ U[self.Restricted_DOF]
+		U[self.free_dof] = self.lu.solve(rhs)
+		return U
+
+def systemKey(K, Restricted_DOF):
+	"""
+	Hash of the stiffness matrix and the constraint set, used as the default cache key.
+	"""
+
+	K = K.tocsr()
+	h = sha1()
+	for a in (K.indptr, K.indices, K.data, unique(asarray(Restricted_DOF, dtype=int).ravel())):
+		h.update(a.tobytes())
+	return h.hexdigest()
+
+def factorize(K, Restricted_DOF, key=None, cache=True):
+	"""
+	Factorizes Kff once. With cache=True the factorization is kept (at most Cache_size of them) and reused by later calls
+	with the same key, by default a hash of K and Restricted_DOF.
+	"""
+
+	if not cache:
+		return Factorization(K, Restricted_DOF)
+
+	key = systemKey(K, Restricted_DOF) if key is None else key
+	if key in _factorizations:
+		_factorizations.move_to_end(key)
+		return _factorizations[key]
+
+	_factorizations[key] = Factorization(K, Restricted_DOF)
+	while len(_factorizations) > Cache_size:
+		_factorizations.popitem(last=False)
+	return _factorizations[key]
+
+def clearFactorizations():
+	_factorizations.clear()
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def bodyForceWeights(nodes, coords):
+	"""
+	Nodal weights (N) such that the body force vector of a uniform load (bx, by, bz) is weights*[bx, by, bz] per node.
+	Same integration as Tet10 (Equation 17.27, AFEM).
+	"""
+
+	nodes = asarray(nodes)
+	w = array([g[0] for g in Gauss_rule])
+	N, dN = referenceShapeFunctions([g[1:] for g in Gauss_rule])
+	we = (w*jacobianDeterminant(asarray(coords, dtype=float)[nodes], dN)) @ N
+	return bincount(nodes.ravel(), weights=we.ravel(), minlength=len(coords))
+
+def loadCaseMatrix(weights, Loaded_DOF, cases, DOFS=3):
+	"""
+	Force vectors of a batch of load cases (3Nxncases).
+
+	Inputs: weights - nodal body force weights (from bodyForceWeights).
+			Loaded_DOF - DOFs that receive the point load f.
+			cases - list of dictionaries with "f", "bx", "by" and "bz" (missing entries are zero).
+	"""
+
+	Loaded_DOF = array(sorted(set(asarray(Loaded_DOF, dtype=int).ravel())), dtype=int)
+	F = zeros((DOFS*len(weights), len(cases)))
+	for i, case in enumerate(cases):
+		for j, b in enumerate(("bx", "by", "bz")):
+			F[j::DOFS, i] = weights*case.get(b, 0)
+		F[Loaded_DOF, i] += case.get("f", 0)
+	return F
+
+def solveLoadCases(K, Restricted_DOF, F, key=None, cache=True):
+	"""
+	Displacements U (3Nxncases) of every column of F, with a single (possibly cached) factorization of Kff.
+	"""
+
+	return factorize(K, Restricted_DOF, key=key, cache=cache).solve(F)
+
+def stressCases(nodes, U, coords, properties, dtype=float64):
+	"""
+	Strains and stresses of every column of U (3Nxncases) in one vectorized pass, each of shape (nex10x6xncases).
+	"""
+
+	return stressField(nodes, U, coords, properties, dtype=dtype)
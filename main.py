@@ -1,67 +1,164 @@
-import gmsh
-from numpy import arange
-from getStress import stress
-from accessMesh import accessMesh
+import json
+import argparse
+import profiling
+from profiling import stage
+from numpy import arange, float32, float64, savez
+from systemCache import loadSystem, readSystem
+from substructuring import substructureSolve
+from outOfCore import streamAnalysis, Block_size
+from getStress import stressField, vonMises
+from parallel import parallelStress, Chunk_size, Modes
 from getDisplacements import deformedShape
+from meshQuality import fileOrder
 
-def main():
-	gmsh.initialize()
-	gmsh.open(file_name)
+def _stresses(system, U, properties, workers, mode, chunk):
+	# Strains and stresses are written per node in the order of the mesh file, which elementTags refers to.
+	if workers is None:
+		ε, σ = stressField(system["elements"], U, system["coords"], properties)
+	else:
+		ε, σ = parallelStress(system["elements"], U, system["coords"], properties, workers, chunk, mode)
+	fileOrder(system["flipped"], ε, σ)
+	return (ε, σ)
 
-	model = gmsh.model
-	mesh = model.mesh
-	entities = model.getEntities()
-	nodeTags, _, _ = mesh.getNodes(-1, -1)
-	_, eleTags, _ = mesh.getElements(-1, -1)
-	globalEleTags = eleTags[2]
-	Nelements = mesh.getMaxElementTag()
+def solve(file_name, properties, f, physicalTags=None, solver="direct", cache_dir=None, parts=None, workers=None, mode="thread",
+		  chunk=Chunk_size):
+	"""
+	Runs the whole analysis without gmsh: mesh reading, stiffness, displacements and stresses.
+	With a cache_dir, the assembled system is reused when neither the mesh nor the properties changed.
+	The direct and cg solvers get Kff and Kfc assembled in reverse Cuthill-McKee order (assembleReduced), never the whole K,
+	and the cholesky solver only the upper triangle of K (assembleUpper).
+	With solver="substructure" the global K is never assembled, parts subdomains are condensed in their own processes.
+	workers threads or processes (mode, chunk elements per task) share the element integration and the stress recovery
+	(0 for one per core), which are serial if None.
+	"""
 
-	pg1, pg2, pg3 = model.getPhysicalGroups(dim=1), model.getPhysicalGroups(dim=2), model.getPhysicalGroups(dim=3)
-	physicalTags = {"fixed": pg2[0][1], "load": pg1[0][1], "body": pg3[0][1]}
+	if solver == "substructure":
+		system, info = readSystem(file_name, physicalTags), {}
+		nodeTags = arange(1, len(system["coords"]) + 1)
+		with stage("displacements"):
+			U = substructureSolve(system["elements"], system["coords"], properties, system["Restricted_DOF"],
+								  system["Loaded_DOF"], f, parts=parts, info=info)
+		system["volume"] = info["volume"]
+		print("DONE COMPUTING DEFORMATIONS!")
+		ε, σ = _stresses(system, U, properties, workers, mode, chunk)
+		print("DONE COMPUTING STRESSES!")
+		print(f"Volume = {round(system['volume'], 5)}")
+		return (system, nodeTags, U, ε, σ)
 
-	K, F, Loaded_DOF, Restricted_DOF, conections, XYZ, volume = accessMesh(model, mesh, entities, nodeTags, physicalTags, properties, Nelements)
+	with stage("stiffness") as counters:
+		reduced, symmetric = solver in ("direct", "cg"), solver == "cholesky"
+		system = loadSystem(file_name, properties, physicalTags, cache_dir=cache_dir, workers=workers, mode=mode,
+							chunk=chunk, reduced=reduced, symmetric=symmetric)
+		if len(system["flipped"]):
+			print(f"REORDERED {len(system['flipped'])} INVERTED ELEMENTS!")
+		counters.update(elements=len(system["elements"]), nnz=(system["Kff"] if reduced else system["K"]).nnz)
 	print("DONE COMPUTING STIFFNESS MATRIX!")
 
-	U = deformedShape(Restricted_DOF, Loaded_DOF, nodeTags, F, K, f)
+	nodeTags = arange(1, len(system["coords"]) + 1)
+	with stage("displacements"):
+		U = deformedShape(system["Restricted_DOF"], system["Loaded_DOF"], nodeTags, system["F"], system["K"], f, solver=solver,
+						  reduced=(system["Kff"], system["Kfc"], system["free_dof"], system["Restricted_DOF"]) if reduced else None,
+						  symmetric=symmetric)
 	print("DONE COMPUTING DEFORMATIONS!")
 
-	εx, εy, εz, εxy, εyz, εzx, σx, σy, σz, σxy, σyz, σzx = stress(conections, U, XYZ, properties, Nelements, globalEleTags)
+	ε, σ = _stresses(system, U, properties, workers, mode, chunk)
 	print("DONE COMPUTING STRESSES!")
 
-	print(f"Volume = {round(volume, 5)}")
-
-	gmsh.view.addHomogeneousModelData(tag=gmsh.view.add("δ"), step=0, modelName=model.getCurrent(), dataType="NodeData", tags=nodeTags, data=U)
-	
-	elementTags = arange(1, Nelements+1)
-	gmsh.view.addModelData(tag=gmsh.view.add("σx"), step=0, modelName=model.getCurrent(), dataType="ElementNodeData", tags=elementTags, data=σx)
-	gmsh.view.addModelData(tag=gmsh.view.add("σy"), step=0, modelName=model.getCurrent(), dataType="ElementNodeData", tags=elementTags, data=σy)
-	gmsh.view.addModelData(tag=gmsh.view.add("σz"), step=0, modelName=model.getCurrent(), dataType="ElementNodeData", tags=elementTags, data=σz)
-	gmsh.view.addModelData(tag=gmsh.view.add("σxy"), step=0, modelName=model.getCurrent(), dataType="ElementNodeData", tags=elementTags, data=σxy)
-	gmsh.view.addModelData(tag=gmsh.view.add("σyz"), step=0, modelName=model.getCurrent(), dataType="ElementNodeData", tags=elementTags, data=σyz)
-	gmsh.view.addModelData(tag=gmsh.view.add("σzx"), step=0, modelName=model.getCurrent(), dataType="ElementNodeData", tags=elementTags, data=σzx)
-
-	gmsh.view.addModelData(tag=gmsh.view.add("εx"), step=0, modelName=model.getCurrent(), dataType="ElementNodeData", tags=elementTags, data=εx)
-	gmsh.view.addModelData(tag=gmsh.view.add("εy"), step=0, modelName=model.getCurrent(), dataType="ElementNodeData", tags=elementTags, data=εy)
-	gmsh.view.addModelData(tag=gmsh.view.add("εz"), step=0, modelName=model.getCurrent(), dataType="ElementNodeData", tags=elementTags, data=εz)
-	gmsh.view.addModelData(tag=gmsh.view.add("εxy"), step=0, modelName=model.getCurrent(), dataType="ElementNodeData", tags=elementTags, data=εxy)
-	gmsh.view.addModelData(tag=gmsh.view.add("εyz"), step=0, modelName=model.getCurrent(), dataType="ElementNodeData", tags=elementTags, data=εyz)
-	gmsh.view.addModelData(tag=gmsh.view.add("εzx"), step=0, modelName=model.getCurrent(), dataType="ElementNodeData", tags=elementTags, data=εzx)
+	print(f"Volume = {round(system['volume'], 5)}")
+	return (system, nodeTags, U, ε, σ)
+
+def writeResults(output, system, nodeTags, U, ε, σ, dtype=float64):
+	"""
+	Writes every result in one uncompressed .npz file (raw binary arrays).
+	"""
+
+	savez(output, nodeTags=nodeTags, elementTags=system["elementTags"], U=U.astype(dtype),
+		  strain=ε.astype(dtype), stress=σ.astype(dtype), vonMises=vonMises(σ).astype(dtype))
+
+def showResults(file_name, system, nodeTags, U, ε, σ):
+	"""
+	Shows the displacements, stresses and strains in the gmsh GUI (gmsh is only imported here).
+	"""
+
+	import gmsh
+	gmsh.initialize()
+	gmsh.open(file_name)
+	model = gmsh.model.getCurrent()
+
+	gmsh.view.addHomogeneousModelData(tag=gmsh.view.add("δ"), step=0, modelName=model, dataType="NodeData", tags=nodeTags, data=U)
+
+	# Same fields as before: tensor shear strains (half of the engineering ones).
+	elementTags = system["elementTags"]
+	for i, name in enumerate(("σx", "σy", "σz", "σxy", "σyz", "σzx")):
+		gmsh.view.addHomogeneousModelData(tag=gmsh.view.add(name), step=0, modelName=model, dataType="ElementNodeData",
+										  tags=elementTags, data=σ[:, :, i].ravel())
+	for i, name in enumerate(("εx", "εy", "εz", "εxy", "εyz", "εzx")):
+		gmsh.view.addHomogeneousModelData(tag=gmsh.view.add(name), step=0, modelName=model, dataType="ElementNodeData",
+										  tags=elementTags, data=(ε[:, :, i] if i < 3 else 0.5*ε[:, :, i]).ravel())
 
 	gmsh.fltk.run()
 	gmsh.finalize()
 
-if __name__ == '__main__':
-	file_name = "cantileverBeam.msh"
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Linear elastic analysis of a 10-node tetrahedron mesh.")
+	parser.add_argument("mesh", nargs="?", default="cantileverBeam.msh", help="Gmsh .msh 4.1 file.")
+	parser.add_argument("--config", help="JSON file with any of the options below (command line values take precedence).")
+	parser.add_argument("--E", type=float, help="Young's modulus [N/m2] (200e9).")
+	parser.add_argument("--nu", type=float, help="Poisson's ratio (0.3).")
+	parser.add_argument("--rho", type=float, help="Density [kg/m3] (7850).")
+	parser.add_argument("--g", type=float, help="Gravity [m/s2] (9.8), applied along -Y.")
+	parser.add_argument("--f", type=float, help="Point load on the loaded nodes [N] (0).")
+	parser.add_argument("--solver", choices=("direct", "cholesky", "cg", "substructure"), help="Linear solver (direct).")
+	parser.add_argument("--parts", type=int, help="Subdomains (worker processes) of --solver substructure (one per core).")
+	parser.add_argument("--workers", type=int, help="Threads or processes integrating the elements and recovering the stresses, 0 for one per core (serial).")
+	parser.add_argument("--worker-mode", choices=Modes, default="thread", help="Share the --workers tasks between threads or processes, the latter through shared memory (thread).")
+	parser.add_argument("--chunk", type=int, default=Chunk_size, help=f"Elements per task of --workers ({Chunk_size}).")
+	parser.add_argument("--cache-dir", help="Reuse assembled systems from this cache directory.")
+	parser.add_argument("--output", help="Write U, strains and stresses to this .npz file.")
+	parser.add_argument("--out-of-core", metavar="DIR", help="Stream the mesh block by block, spilling to DIR, where the results are left as .npy files.")
+	parser.add_argument("--block", type=int, default=Block_size, help=f"Elements per block of --out-of-core ({Block_size}).")
+	parser.add_argument("--float32", action="store_true", help="Write the results in single precision.")
+	parser.add_argument("--profile", help="Write per-stage timings, memory and counts to this JSON file.")
+	parser.add_argument("--trace", help="Write the stages as Chrome trace events to this JSON file.")
+	parser.add_argument("--cprofile", metavar="STAGE", help="Capture this stage (e.g. solve) with cProfile in the profile.")
+	parser.add_argument("--gui", action="store_true", help="Show the results in gmsh (default when there is no --output).")
+	args = parser.parse_args(argv)
 
-	f = 0 			# N
-	g = 9.8 		# m/s2
-	ρ = 7850 		# kg/m3
-	E = 200_000e6 	# N/m2
-	ν = 0.3
+	options = {"E": 200_000e6, "nu": 0.3, "rho": 7850, "g": 9.8, "f": 0, "solver": "direct", "cache_dir": None}
+	if args.config:
+		with open(args.config) as file:
+			options.update(json.load(file))
+	options.update({k: v for k, v in vars(args).items() if k in options and v is not None})
+	if args.out_of_core and options["solver"] == "substructure":
+		parser.error("--out-of-core streams one global system, it cannot be used with --solver substructure")
 
-	properties = {"E" : E,
-				  "nu": ν,
+	properties = {"E" : options["E"],
+				  "nu": options["nu"],
 				  "bx": 0,
-				  "by": -ρ*g,
+				  "by": -options["rho"]*options["g"],
 				  "bz": 0}
-	main()
\ No newline at end of file
+
+	if args.profile or args.trace or args.cprofile:
+		profiling.enable(profile=args.cprofile)
+
+	dtype = float32 if args.float32 else float64
+	if args.out_of_core:
+		# The direct solver needs the whole matrix, the out-of-core system is factored from its upper triangle.
+		solver = "cholesky" if options["solver"] == "direct" else options["solver"]
+		system = streamAnalysis(args.mesh, properties, options["f"], args.out_of_core, args.block, solver=solver, dtype=dtype)
+		nodeTags, U, ε, σ = arange(1, len(system["coords"]) + 1), system["U"], system["strain"], system["stress"]
+	else:
+		system, nodeTags, U, ε, σ = solve(args.mesh, properties, options["f"], solver=options["solver"], cache_dir=options["cache_dir"],
+										  parts=args.parts, workers=args.workers, mode=args.worker_mode, chunk=args.chunk)
+
+	if args.output:
+		writeResults(args.output, system, nodeTags, U, ε, σ, dtype=dtype)
+	if args.profile or args.cprofile:
+		profiling.writeJSON(args.profile or "profile.json")
+	if args.trace:
+		profiling.writeTrace(args.trace)
+	if args.gui or not (args.output or args.out_of_core):
+		showResults(args.mesh, system, nodeTags, U, ε, σ)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,111 @@
+from tet10 import Tet10Batch, Gauss_rule, referenceShapeFunctions, elasticityMatrix, jacobianDeterminant, shapeGradients
+from accessMesh import elementDOFs
+from numpy import array, asarray, bincount, einsum, zeros
+from scipy.sparse.linalg import LinearOperator
+
+# Entries of the flattened displacement gradient (d(u_c)/d(x_k) at 3k + c) summed into the engineering strains (xx, yy, zz,
+# xy, yz, zx), and the Voigt index of every entry of the stress tensor.
+_Strain, _StrainT = [0, 4, 8, 1, 5, 2], [0, 4, 8, 3, 7, 6]
+_Tensor = array([[0, 3, 5], [3, 1, 4], [5, 4, 2]])
+
+class Tet10Operator(LinearOperator):
+	"""
+	Matrix-free stiffness operator: K @ u is applied element by element (gather, ke @ ue, scatter) and K is never formed.
+
+	Inputs: nodes - 0-based node connectivity (nex10).
+			coords - nodal coordinates (Nnodesx3).
+			properties - dictionary of material properties.
+			store - "geometry" keeps the shape function derivatives and weights of the Gauss points (124 values per element),
+					"ke" the 30x30 ke blocks (900 values per element, fewest flops per product) and None recomputes the
+					element matrices at every product (smallest memory).
+			chunk - number of elements processed at once.
+			dtype - storage type of the stored arrays (float32 halves their memory).
+
+	Attributes: F - global force vector.
+				volume - total volume.
+	"""
+
+	def __init__(self, nodes, coords, properties, DOFS=3, store="geometry", chunk=20000, dtype=float):
+		if store not in ("geometry", "ke", None):
+			raise ValueError(f"Unknown store '{store}'!")
+
+		self.nodes, self.coords = asarray(nodes), asarray(coords, dtype=float)
+		self.properties, self.chunk = properties, chunk
+		self.dofs = elementDOFs(self.nodes, DOFS)
+		n, ne = DOFS*len(self.coords), len(self.nodes)
+		super().__init__(dtype=float, shape=(n, n))
+
+		# A first pass gives the force vector, the volume and the diagonal (and the stored arrays).
+		self.ke = zeros((ne, 30, 30), dtype=dtype) if store == "ke" else None
+		self.q = zeros((ne, len(Gauss_rule), 10, 3), dtype=dtype) if store == "geometry" else None
+		self.wJ = zeros((ne, len(Gauss_rule)), dtype=dtype) if store == "geometry" else None
+		self.F, self.volume, self._diagonal = zeros(n), 0, zeros(n)
+		w = array([g[0] for g in Gauss_rule])
+		_, dN = referenceShapeFunctions([g[1:] for g in Gauss_rule])
+		for s in self._chunks():
+			xyz = self.coords[self.nodes[s]]
+			ke, fe, vol = Tet10Batch(xyz, properties)
+			if store == "ke":
+				self.ke[s] = ke
+			elif store == "geometry":
+				det_J = jacobianDeterminant(xyz, dN)
+				self.q[s], self.wJ[s] = shapeGradients(xyz, dN, det_J), w*det_J
+			self.F += bincount(self.dofs[s].ravel(), weights=fe.ravel(), minlength=n)
+			self._diagonal += bincount(self.dofs[s].ravel(), weights=einsum("eii->ei", ke).ravel(), minlength=n)
+			self.volume += vol.sum()
+
+	def _chunks(self):
+		for start in range(0, len(self.nodes), self.chunk):
+			yield slice(start, start + self.chunk)
+
+	def _blocks(self, s):
+		return self.ke[s] if self.ke is not None else Tet10Batch(self.coords[self.nodes[s]], self.properties)[0]
+
+	def _geometricProduct(self, s, ue):
+		# ke @ ue = sum over the Gauss points of wJ B^T σ, with B applied through the stored derivatives q instead of formed.
+		q = asarray(self.q[s], dtype=float)
+		G = (q.transpose(0, 1, 3, 2) @ ue.reshape(len(ue), 1, 10, 3)).reshape(q.shape[:2] + (9,))
+		ε = G[..., _Strain] + G[..., _StrainT]
+		ε[..., :3] /= 2
+		σ = (ε @ elasticityMatrix(self.properties).T)*asarray(self.wJ[s], dtype=float)[..., None]
+		return (q @ σ[..., _Tensor]).sum(axis=1).reshape(len(ue), 30)
+
+	def _matvec(self, x):
+		x = asarray(x).ravel()
+		y = zeros(self.shape[0])
+		for s in self._chunks():
+			d = self.dofs[s]
+			ye = self._geometricProduct(s, x[d]) if self.q is not None else einsum("eij,ej->ei", self._blocks(s), x[d])
+			y += bincount(d.ravel(), weights=ye.ravel(), minlength=self.shape[0])
+		return y
+
+	def _rmatvec(self, x):
+		return self._matvec(x)
+
+	def diagonal(self):
+		return self._diagonal.copy()
+
+	def memory(self):
+		"""
+		Bytes held by the operator (connectivity, DOF map and stored arrays).
+		"""
+
+		return self.nodes.nbytes + self.dofs.nbytes + sum(a.nbytes for a in (self.ke, self.q, self.wJ) if a is not None)
+
+class RestrictedOperator(LinearOperator):
+	"""
+	Block K[rows, cols] of a LinearOperator, applied through the full operator.
+	"""
+
+	def __init__(self, K, rows, cols):
+		self.K, self.rows, self.cols = K, asarray(rows), asarray(cols)
+		super().__init__(dtype=float, shape=(len(self.rows), len(self.cols)))
+
+	def _matvec(self, x):
+		u = zeros(self.K.shape[1])
+		u[self.cols] = asarray(x).ravel()
+		return (self.K @ u)[self.rows]
+
+	def diagonal(self):
+		# Only meaningful for diagonal blocks (rows == cols).
+		return self.K.diagonal()[self.rows]
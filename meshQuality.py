@@ -0,0 +1,99 @@
+from tet10 import Gauss_rule, Natural_coords, referenceShapeFunctions, jacobianDeterminant
+from boxMesh import Edges
+from profiling import stage
+from numpy import asarray, cross, einsum, empty, flatnonzero, float64, sqrt, stack
+from numpy.linalg import norm
+
+# Node order of an element with corners 2 and 3 swapped (0-based 1 and 2), the midside nodes follow their edges.
+_corners = (0, 2, 1, 3)
+Flip = _corners + tuple(4 + Edges.index(e) if e in Edges else 4 + Edges.index(e[::-1])
+						for e in ((_corners[a], _corners[b]) for a, b in Edges))
+
+def elementQuality(nodes, coords, chunk=50000):
+	"""
+	Vectorized quality metrics of every element.
+
+	Inputs: nodes - 0-based node connectivity (nex10).
+			coords - nodal coordinates (Nnodesx3).
+
+	Outputs: dictionary with
+			 volume - signed volume of the corner tetrahedron (negative when the element is inverted).
+			 minDetJ, maxDetJ - extreme det(J) over the Gauss points and the nodes.
+			 scaledJacobian - minimum over the corners of det(e1, e2, e3)/(|e1||e2||e3|), scaled to 1 for a regular tetrahedron.
+			 maxScaledJacobian - maximum over the corners of the same ratio, sqrt(2) at most (a right-angled corner).
+			 aspectRatio - longest edge over 2 sqrt(6) times the inradius, 1 for a regular tetrahedron.
+	"""
+
+	nodes, coords = asarray(nodes), asarray(coords, dtype=float)
+	_, dN = referenceShapeFunctions([g[1:] for g in Gauss_rule] + list(Natural_coords))
+	ne = len(nodes)
+	q = {name: empty(ne, dtype=float64) for name in ("volume", "minDetJ", "maxDetJ", "scaledJacobian", "maxScaledJacobian", "aspectRatio")}
+
+	for start in range(0, ne, chunk):
+		s = slice(start, start + chunk)
+		xyz = coords[nodes[s]]
+		det_J = jacobianDeterminant(xyz, dN)
+		q["minDetJ"][s], q["maxDetJ"][s] = det_J.min(axis=1), det_J.max(axis=1)
+
+		c = xyz[:, :4]
+		e = c[:, 1:] - c[:, :1]
+		q["volume"][s] = einsum("ei,ei->e", e[:, 0], cross(e[:, 1], e[:, 2]))/6
+
+		# Three edges of every corner, in the same right-handed order as at corner 0.
+		sj = []
+		for k, a, b, d in ((0, 1, 2, 3), (1, 2, 0, 3), (2, 0, 1, 3), (3, 1, 0, 2)):
+			u, v, w = c[:, a] - c[:, k], c[:, b] - c[:, k], c[:, d] - c[:, k]
+			sj.append(einsum("ei,ei->e", u, cross(v, w))/(norm(u, axis=1)*norm(v, axis=1)*norm(w, axis=1)))
+		sj = sqrt(2)*stack(sj, axis=1)
+		q["scaledJacobian"][s], q["maxScaledJacobian"][s] = sj.min(axis=1), sj.max(axis=1)
+
+		lengths = stack([norm(c[:, a] - c[:, b], axis=1) for a, b in Edges], axis=1)
+		areas = sum(norm(cross(c[:, b] - c[:, a], c[:, d] - c[:, a]), axis=1)/2 for a, b, d in ((1, 2, 3), (0, 2, 3), (0, 1, 3), (0, 1, 2)))
+		inradius = 3*abs(q["volume"][s])/areas
+		q["aspectRatio"][s] = lengths.max(axis=1)/(2*sqrt(6)*inradius)
+
+	return q
+
+def checkMesh(nodes, coords, fix=True, strict=True, chunk=50000):
+	"""
+	Pre-pass over the whole connectivity before assembly: inverted elements are fixed by swapping two corners (and their
+	midside nodes), the quality of every element is measured, and elements with det(J) <= 0 at a Gauss point or node
+	after the fix are reported. Assembly does not validate elements itself.
+
+	Inputs: nodes - 0-based node connectivity (nex10).
+			coords - nodal coordinates (Nnodesx3).
+			fix - reorder the nodes of the inverted elements.
+			strict - raise a ValueError when invalid elements remain.
+
+	Outputs: nodes - connectivity with the inverted elements reordered (a copy if any was fixed).
+			 report - elementQuality metrics plus the rows of the flipped and invalid elements.
+	"""
+
+	nodes = asarray(nodes)
+	with stage("mesh check", elements=len(nodes)) as counters:
+		quality = elementQuality(nodes, coords, chunk)
+		flipped = flatnonzero(quality["volume"] < 0)
+		if fix and len(flipped):
+			nodes = nodes.copy()
+			nodes[flipped] = nodes[flipped][:, list(Flip)]
+			fixed = elementQuality(nodes[flipped], coords, chunk)
+			for name, values in fixed.items():
+				quality[name][flipped] = values
+
+		invalid = flatnonzero(quality["minDetJ"] <= 0)
+		counters.update(flipped=len(flipped), invalid=len(invalid))
+
+	report = dict(quality, flipped=flipped, invalid=invalid)
+	if strict and len(invalid):
+		worst = invalid[quality["minDetJ"][invalid].argmin()]
+		raise ValueError(f"{len(invalid)} elements have det(J) <= 0 (element row {worst}: min det(J) = {quality['minDetJ'][worst]:.3e})!")
+	return (nodes, report)
+
+def fileOrder(flipped, *fields):
+	"""
+	Puts the per-node values (nex10x...) of the elements reordered by checkMesh back in the node order of the mesh file,
+	in place. Flip is its own inverse.
+	"""
+
+	for values in fields:
+		values[flipped] = values[flipped][:, list(Flip)]
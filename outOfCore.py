@@ -0,0 +1,225 @@
+import os
+from tet10 import Tet10Batch, Tet10StrainBatch
+from profiling import stage
+from readMesh import readMshBoundary, elementBlocks, defaultPhysicalTags, boundaryDOFs
+from accessMesh import elementDOFs
+from meshQuality import checkMesh, fileOrder, Flip
+from getDisplacements import deformedShape
+from symmetric import SymmetricOperator
+from numpy import arange, argsort, asarray, bincount, broadcast_to, concatenate, cumsum, float64, inf, int32, int64, load, memmap, save, searchsorted, zeros
+from numpy.lib.format import open_memmap
+from scipy.sparse import csr_matrix
+
+# ----------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Out-of-core pipeline for meshes larger than the memory. Elements are read from the .msh file, integrated and scattered a
+# block at a time, their triplets are spilled to files in a work directory and turned into CSR on disk, and the stresses
+# are recovered block by block into memory-mapped .npy files. Apart from the nodal arrays (coordinates, F, U, CSR row
+# pointers), the memory in use by the assembly and the stress recovery is set by the block size. So is that of the solve
+# with solver="cg", which applies the memory-mapped upper triangle through SymmetricOperator. The factorizations are not
+# out-of-core: symmetricBlocks copies Kff out of the map and SymmetricFactorization forms Ku + Ku^T for the reverse
+# Cuthill-McKee ordering (and the whole matrix for SuperLU), so K is held in memory about twice, besides the factor.
+# ----------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+Block_size = 50000
+
+def _memmap(path, dtype, shape=None):
+	return memmap(path, dtype=dtype, mode="r", shape=shape) if os.path.getsize(path) else zeros(0 if shape is None else shape, dtype=dtype)
+
+def streamCheck(file_name, coords, block=Block_size, physicalTag=None):
+	"""
+	checkMesh over the whole connectivity, streamed block by block, before anything is integrated or spilled.
+
+	Outputs: dictionary with the rows (in file order) of the flipped elements, which assembly reorders, and the minimum
+			 det(J), scaled Jacobian and maximum aspect ratio of the mesh. A ValueError is raised if invalid elements remain.
+	"""
+
+	flipped, invalid, ne = [], [], 0
+	quality = {"minDetJ": inf, "scaledJacobian": inf, "aspectRatio": 0.}
+	worst = (inf, -1)
+	for _, nodes in elementBlocks(file_name, block, physicalTag=physicalTag):
+		_, report = checkMesh(nodes, coords, strict=False)
+		flipped.append(report["flipped"] + ne)
+		invalid.append(report["invalid"] + ne)
+		if len(report["invalid"]):
+			i = report["invalid"][report["minDetJ"][report["invalid"]].argmin()]
+			worst = min(worst, (report["minDetJ"][i], ne + i))
+		quality.update(minDetJ=min(quality["minDetJ"], report["minDetJ"].min(initial=inf)),
+					   scaledJacobian=min(quality["scaledJacobian"], report["scaledJacobian"].min(initial=inf)),
+					   aspectRatio=max(quality["aspectRatio"], report["aspectRatio"].max(initial=0)))
+		ne += len(nodes)
+
+	quality.update(flipped=concatenate(flipped) if flipped else zeros(0, dtype=int64),
+				   invalid=concatenate(invalid) if invalid else zeros(0, dtype=int64))
+	if len(quality["invalid"]):
+		raise ValueError(f"{len(quality['invalid'])} elements have det(J) <= 0 (element row {worst[1]}: min det(J) = {worst[0]:.3e})!")
+	return quality
+
+def streamAssembly(file_name, coords, properties, work_dir, block=Block_size, physicalTag=None, DOFS=3):
+	"""
+	Out-of-core assembly of the upper triangle of K (as assembleUpper) straight from the mesh file.
+
+	Inputs: file_name - path to the .msh file.
+			coords - nodal coordinates (Nnodesx3).
+			properties - dictionary of material properties.
+			work_dir - directory of the spilled triplets and of the resulting arrays.
+			block - number of elements read, integrated and scattered at once.
+			physicalTag - physical group of the solid elements (every solid element if None).
+
+	Outputs: dictionary with
+			 K - upper triangle of K (CSR whose data and indices are memory-mapped from work_dir).
+			 F - global force vector.
+			 elements, elementTags - memory-mapped connectivity (nex10) and tags of the elements, in file order, inverted
+									 elements reordered.
+			 volume - total volume.
+			 quality - streamCheck report, the mesh is checked in a first pass so that an invalid mesh fails early.
+	"""
+
+	os.makedirs(work_dir, exist_ok=True)
+	coords = asarray(coords, dtype=float)
+	ndof = DOFS*len(coords)
+	index = int32 if ndof < 2**31 else int64
+	F, volume, ne, count = zeros(ndof), 0., 0, 0
+	quality = streamCheck(file_name, coords, block, physicalTag)
+	flipped = quality["flipped"]
+
+	names = ("rows", "cols", "values", "elements", "elementTags")
+	files = {name: open(os.path.join(work_dir, name + ".bin"), "wb") for name in names}
+	try:
+		for tags, nodes in elementBlocks(file_name, block, physicalTag=physicalTag):
+			rows = flipped[(flipped >= ne) & (flipped < ne + len(nodes))] - ne
+			nodes[rows] = nodes[rows][:, list(Flip)]
+			with stage("integration", elements=len(nodes)):
+				ke, fe, vol = Tet10Batch(coords[nodes], properties)
+
+			with stage("scatter"):
+				d = elementDOFs(nodes, DOFS).astype(index)
+				F += bincount(d.ravel(), weights=fe.ravel(), minlength=ndof)
+				rows, cols = broadcast_to(d[:, :, None], ke.shape), broadcast_to(d[:, None, :], ke.shape)
+				upper = rows <= cols
+				for name, values in (("rows", rows[upper]), ("cols", cols[upper]), ("values", ke[upper]),
+									 ("elements", nodes.astype(index)), ("elementTags", tags)):
+					values.tofile(files[name])
+
+			volume += vol.sum()
+			ne, count = ne + len(nodes), count + int(upper.sum())
+	finally:
+		for file in files.values():
+			file.close()
+
+	K = _spilledCSR(work_dir, count, ndof, index, 465*block)
+	for name in ("rows", "cols", "values"):
+		os.remove(os.path.join(work_dir, name + ".bin"))
+
+	return {"K": K, "F": F, "volume": volume, "quality": quality,
+			"elements": _memmap(os.path.join(work_dir, "elements.bin"), index, (ne, 10)),
+			"elementTags": _memmap(os.path.join(work_dir, "elementTags.bin"), int64)}
+
+def _spilledCSR(work_dir, count, ndof, index, step):
+	"""
+	CSR matrix of the spilled triplets, built on disk: the triplets are bucketed by row into a memory-mapped CSR with
+	duplicates, whose rows are then summed step entries at a time. index only has to hold the DOFs, the row pointer holds
+	nnz, which passes 2**31 long before ndof does, so the CSR indices are int64 unless the triplet count (a bound of nnz)
+	fits in int32.
+	"""
+
+	rows = _memmap(os.path.join(work_dir, "rows.bin"), index)
+	cols = _memmap(os.path.join(work_dir, "cols.bin"), index)
+	values = _memmap(os.path.join(work_dir, "values.bin"), float64)
+
+	csr_index = index if count < 2**31 else int64
+	with stage("csr conversion", triplets=count) as counters:
+		indptr = zeros(ndof + 1, dtype=int64)
+		for start in range(0, count, step):
+			indptr[1:] += bincount(rows[start:start + step], minlength=ndof)
+		indptr = cumsum(indptr)
+
+		# Counting sort: every triplet goes to the next free slot of its row.
+		indices = open_memmap(os.path.join(work_dir, "duplicates_indices.npy"), mode="w+", dtype=index, shape=(max(count, 1),))
+		data = open_memmap(os.path.join(work_dir, "duplicates_data.npy"), mode="w+", dtype=float64, shape=(max(count, 1),))
+		following = indptr[:-1].copy()
+		for start in range(0, count, step):
+			r = asarray(rows[start:start + step])
+			order = argsort(r, kind="stable")
+			r = r[order]
+			position = following[r] + arange(len(r)) - searchsorted(r, r)
+			indices[position], data[position] = cols[start:start + step][order], values[start:start + step][order]
+			following += bincount(r, minlength=ndof)
+
+		# Rows are summed in groups of about step entries and appended to the final arrays.
+		pointer = zeros(ndof + 1, dtype=int64)
+		with open(os.path.join(work_dir, "K_indices.bin"), "wb") as fi, open(os.path.join(work_dir, "K_data.bin"), "wb") as fd:
+			first = 0
+			while first < ndof:
+				last = min(max(int(searchsorted(indptr, indptr[first] + step, side="right")) - 1, first + 1), ndof)
+				lo, hi = indptr[first], indptr[last]
+				piece = csr_matrix((asarray(data[lo:hi]), asarray(indices[lo:hi]), indptr[first:last + 1] - lo), shape=(last - first, ndof))
+				piece.sum_duplicates()
+				piece.indices.astype(csr_index).tofile(fi)
+				piece.data.tofile(fd)
+				pointer[first + 1:last + 1] = pointer[first] + piece.indptr[1:]
+				first = last
+
+		del indices, data
+		for name in ("duplicates_indices.npy", "duplicates_data.npy"):
+			os.remove(os.path.join(work_dir, name))
+		counters["nnz"] = int(pointer[-1])
+
+	return csr_matrix((_memmap(os.path.join(work_dir, "K_data.bin"), float64),
+					   _memmap(os.path.join(work_dir, "K_indices.bin"), csr_index), pointer.astype(csr_index)), shape=(ndof, ndof), copy=False)
+
+def streamStress(elements, U, coords, properties, work_dir, block=Block_size, flipped=None, dtype=float64, DOFS=3):
+	"""
+	Stress/strain recovery block by block into memory-mapped .npy files (strain.npy and stress.npy in work_dir), laid
+	out as stressField (nex10x6).
+
+	Inputs: elements - 0-based node connectivity (nex10), usually the memory-mapped one of streamAssembly.
+			U - displacements (3N), or the path of a .npy file that is memory-mapped.
+			flipped - rows of the elements reordered by streamAssembly, whose values are put back in the node order of
+					  the mesh file.
+	"""
+
+	U = load(U, mmap_mode="r") if isinstance(U, str) else U
+	Un, coords = U.reshape(-1, DOFS), asarray(coords, dtype=float)
+	ε = open_memmap(os.path.join(work_dir, "strain.npy"), mode="w+", dtype=dtype, shape=(len(elements), 10, 6))
+	σ = open_memmap(os.path.join(work_dir, "stress.npy"), mode="w+", dtype=dtype, shape=(len(elements), 10, 6))
+
+	with stage("stress recovery", elements=len(elements)):
+		for start in range(0, len(elements), block):
+			e = asarray(elements[start:start + block])
+			ue = asarray(Un[e]).reshape(len(e), 10*DOFS)
+			εe, σe = Tet10StrainBatch(coords[e], properties, ue)
+			if flipped is not None:
+				fileOrder(flipped[(flipped >= start) & (flipped < start + len(e))] - start, εe, σe)
+			ε[start:start + block], σ[start:start + block] = εe, σe
+			ε.flush()
+			σ.flush()
+
+	return (ε, σ)
+
+def streamAnalysis(file_name, properties, f, work_dir, block=Block_size, physicalTags=None, solver="cholesky", dtype=float64, DOFS=3):
+	"""
+	Whole out-of-core analysis. Every result is left in work_dir: U.npy, strain.npy, stress.npy and the elements/elementTags
+	of the mesh, and returned memory-mapped. Only solver="cg" keeps K on disk during the solve, "cholesky" reads it into
+	memory (see the module notes).
+	"""
+
+	meshData = readMshBoundary(file_name)
+	physicalTags = defaultPhysicalTags(meshData) if physicalTags is None else physicalTags
+	Restricted_DOF, Loaded_DOF = boundaryDOFs(meshData, physicalTags, DOFS)
+	coords = meshData["coords"]
+
+	with stage("stiffness"):
+		system = streamAssembly(file_name, coords, properties, work_dir, block, physicalTags["body"], DOFS)
+
+	# CG goes through the operator of the whole mapped matrix (RestrictedOperator), Kff is never sliced out of it.
+	with stage("displacements"):
+		cg = solver == "cg"
+		K = SymmetricOperator(system["K"]) if cg else system["K"]
+		U = deformedShape(Restricted_DOF, Loaded_DOF, arange(1, len(coords) + 1), system["F"], K, f, DOFS=DOFS,
+						  solver=solver, symmetric=not cg)
+	save(os.path.join(work_dir, "U.npy"), U)
+	del U
+
+	U = os.path.join(work_dir, "U.npy")
+	ε, σ = streamStress(system["elements"], U, coords, properties, work_dir, block, system["quality"]["flipped"], dtype, DOFS)
+	return dict(system, U=load(U, mmap_mode="r"), strain=ε, stress=σ, coords=coords)
@@ -0,0 +1,172 @@
+import os
+from multiprocessing import shared_memory
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from tet10 import Tet10Batch, Tet10StrainBatch
+from accessMesh import elementDOFs
+from profiling import stage
+from numpy import asarray, bincount, dtype as np_dtype, empty, float64, ndarray, prod
+from scipy.sparse import coo_matrix
+
+# ----------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Element chunks are written straight into preallocated output arrays. With mode="process" those arrays are allocated in
+# shared memory, the inputs are copied there once and nothing but the chunk bounds is pickled. Chunk boundaries depend only
+# on the chunk size, never on the number of workers, so every element is always integrated in the same batch and the
+# results are bit-for-bit identical for any worker count.
+# ----------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+Chunk_size = 20000
+Modes = ("thread", "process")
+
+def _share(arrays):
+	"""
+	Copies arrays into shared memory blocks. Returns the blocks and the specs (name, shape, dtype) to attach them.
+	"""
+
+	blocks, specs = [], {}
+	for key, a in arrays.items():
+		shm = shared_memory.SharedMemory(create=True, size=max(a.nbytes, 1))
+		ndarray(a.shape, dtype=a.dtype, buffer=shm.buf)[...] = a
+		blocks.append(shm)
+		specs[key] = (shm.name, a.shape, a.dtype.str)
+	return blocks, specs
+
+def _allocate(outputs):
+	"""
+	Uninitialized shared memory blocks for the outputs {key: (shape, dtype)}, nothing is copied into them.
+	"""
+
+	blocks, specs = [], {}
+	for key, (shape, kind) in outputs.items():
+		kind = np_dtype(kind)
+		shm = shared_memory.SharedMemory(create=True, size=max(int(prod(shape))*kind.itemsize, 1))
+		blocks.append(shm)
+		specs[key] = (shm.name, shape, kind.str)
+	return blocks, specs
+
+def _attach(specs):
+	blocks, arrays = [], {}
+	for key, (name, shape, kind) in specs.items():
+		shm = shared_memory.SharedMemory(name=name)
+		blocks.append(shm)
+		arrays[key] = ndarray(shape, dtype=np_dtype(kind), buffer=shm.buf)
+	return blocks, arrays
+
+def _run(task, inputs, outputs, chunks, properties, workers, mode, finish):
+	"""
+	Runs task(arrays, start, stop, properties) on every chunk, with threads or processes, and returns finish(arrays).
+
+	outputs - {key: (shape, dtype)} of the arrays written by the tasks. With mode="process" they are allocated straight in
+			  shared memory and only live while finish runs, so finish must copy (or reduce) whatever it keeps.
+	"""
+
+	if workers == 1 or mode == "thread":
+		arrays = dict(inputs, **{key: empty(shape, dtype=kind) for key, (shape, kind) in outputs.items()})
+		if workers == 1:
+			for start, stop in chunks:
+				task(arrays, start, stop, properties)
+		else:
+			with ThreadPoolExecutor(workers) as pool:
+				list(pool.map(lambda c: task(arrays, c[0], c[1], properties), chunks))
+		return finish(arrays)
+
+	blocks, specs = _share(inputs)
+	try:
+		more, outputSpecs = _allocate(outputs)
+		blocks += more
+		specs.update(outputSpecs)
+		with ProcessPoolExecutor(workers) as pool:
+			list(pool.map(_sharedTask, [(task, specs, start, stop, properties) for start, stop in chunks]))
+
+		# The views must be gone before the blocks are closed.
+		arrays = {key: ndarray(shape, dtype=np_dtype(kind), buffer=shm.buf) for (key, (_, shape, kind)), shm in zip(specs.items(), blocks)}
+		result = finish(arrays)
+		del arrays
+		return result
+	finally:
+		for shm in blocks:
+			shm.close()
+			shm.unlink()
+
+def _sharedTask(args):
+	task, specs, start, stop, properties = args
+	blocks, arrays = _attach(specs)
+	try:
+		task(arrays, start, stop, properties)
+	finally:
+		del arrays
+		for shm in blocks:
+			shm.close()
+
+def _chunks(n, chunk):
+	return [(start, min(start + chunk, n)) for start in range(0, n, chunk)]
+
+# ----------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def _assembleTask(a, start, stop, properties):
+	nodes = a["nodes"][start:stop]
+	ke, fe, vol = Tet10Batch(a["coords"][nodes], properties)
+	d = a["dofs"][start:stop]
+	a["rows"][start:stop] = d[:, :, None]
+	a["cols"][start:stop] = d[:, None, :]
+	a["vals"][start:stop] = ke
+	a["fe"][start:stop] = fe
+	a["vol"][start:stop] = vol
+
+def parallelAssembly(nodes, coords, properties, workers=None, chunk=Chunk_size, mode="thread", DOFS=3):
+	"""
+	Same result as assembleStiffness, with the element integration split into chunks over several workers.
+
+	Inputs: nodes - 0-based node connectivity (nex10).
+			coords - nodal coordinates (Nnodesx3).
+			properties - dictionary of material properties.
+			workers - number of threads or processes (all cores by default).
+			chunk - number of elements per task.
+			mode - "thread" (NumPy releases the GIL in its kernels) or "process" (shared memory buffers).
+
+	Outputs: K - global stiffness matrix (CSR).
+			 F - global force vector.
+			 volume - total volume.
+	"""
+
+	nodes, coords = asarray(nodes), asarray(coords, dtype=float)
+	workers = workers or os.cpu_count()
+	ndof, ne = DOFS*len(coords), len(nodes)
+	dofs = elementDOFs(nodes, DOFS)
+	nd = dofs.shape[1]
+
+	# The triplets go straight into CSR (and the per-element arrays into F and the volume) while the outputs are alive.
+	def finish(a):
+		K = coo_matrix((a["vals"].ravel(), (a["rows"].ravel(), a["cols"].ravel())), shape=(ndof, ndof)).tocsr()
+		return (K, bincount(dofs.ravel(), weights=a["fe"].ravel(), minlength=ndof), a["vol"].sum())
+
+	inputs = {"nodes": nodes, "coords": coords, "dofs": dofs}
+	outputs = {"rows": ((ne, nd, nd), dofs.dtype), "cols": ((ne, nd, nd), dofs.dtype), "vals": ((ne, nd, nd), float64),
+			   "fe": ((ne, nd), float64), "vol": ((ne,), float64)}
+	with stage("parallel assembly", elements=ne, workers=workers):
+		return _run(_assembleTask, inputs, outputs, _chunks(ne, chunk), properties, workers, mode, finish)
+
+# ----------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def _stressTask(a, start, stop, properties):
+	nodes = a["nodes"][start:stop]
+	Un = a["U"].reshape((-1, 3) + a["U"].shape[1:])
+	ue = Un[nodes].reshape((len(nodes), 30) + a["U"].shape[1:])
+	a["ε"][start:stop], a["σ"][start:stop] = Tet10StrainBatch(a["coords"][nodes], properties, ue)
+
+def parallelStress(nodes, U, coords, properties, workers=None, chunk=Chunk_size, mode="thread", dtype=float64):
+	"""
+	Same result as stressField, with the elements split into chunks over several workers.
+	"""
+
+	nodes, U, coords = asarray(nodes), asarray(U, dtype=float), asarray(coords, dtype=float)
+	workers = workers or os.cpu_count()
+	shape = (len(nodes), 10, 6) + U.shape[1:]
+
+	# The stresses are the result itself, they are copied out of shared memory.
+	def finish(a):
+		return (a["ε"].copy(), a["σ"].copy()) if mode == "process" and workers > 1 else (a["ε"], a["σ"])
+
+	inputs = {"nodes": nodes, "coords": coords, "U": U}
+	with stage("stress recovery", elements=len(nodes), workers=workers):
+		return _run(_stressTask, inputs, {"ε": (shape, dtype), "σ": (shape, dtype)}, _chunks(len(nodes), chunk), properties, workers,
+					mode, finish)
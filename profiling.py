@@ -0,0 +1,84 @@
+import os
+import io
+import json
+import pstats
+import cProfile
+import resource
+from contextlib import contextmanager
+from time import perf_counter, process_time
+
+# ----------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Instrumentation of the solve pipeline. Stages are wrapped in "with stage(name) as counters:" and may store counts in the
+# yielded dictionary (elements, nnz, iterations, ...). While profiling is disabled, stage() only checks a flag and yields a
+# throwaway dictionary.
+# ----------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+Enabled = False
+Records = []
+_profiled = None
+_origin = perf_counter()
+_depth = 0
+_discard = {}
+
+def enable(profile=None):
+	"""
+	Starts recording stages. profile - name of a stage to capture with cProfile.
+	"""
+
+	global Enabled, _profiled, _origin
+	Enabled, _profiled, _origin = True, profile, perf_counter()
+	Records.clear()
+
+def disable():
+	global Enabled
+	Enabled = False
+
+def _rss_kb():
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+@contextmanager
+def stage(name, **counters):
+	global _depth
+	if not Enabled:
+		_discard.clear()
+		yield _discard
+		return
+
+	record = {"stage": name, "depth": _depth, **counters}
+	profiler = cProfile.Profile() if name == _profiled else None
+	start, cpu = perf_counter(), process_time()
+	_depth += 1
+	if profiler is not None:
+		profiler.enable()
+	try:
+		yield record
+	finally:
+		if profiler is not None:
+			profiler.disable()
+			text = io.StringIO()
+			pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(30)
+			record["cprofile"] = text.getvalue()
+		_depth -= 1
+		record.update(start=start - _origin, wall=perf_counter() - start, cpu=process_time() - cpu, peak_rss_kb=_rss_kb())
+		Records.append(record)
+
+def report():
+	"""
+	Recorded stages in the order they started.
+	"""
+
+	return sorted(Records, key=lambda r: r["start"])
+
+def writeJSON(file_name):
+	with open(file_name, "w") as file:
+		json.dump(report(), file, indent=1, default=float)
+
+def writeTrace(file_name):
+	"""
+	Writes the stages as Chrome trace events (chrome://tracing, Perfetto).
+	"""
+
+	events = [{"name": r["stage"], "ph": "X", "pid": os.getpid(), "tid": 0, "ts": 1e6*r["start"], "dur": 1e6*r["wall"],
+			   "args": {k: v for k, v in r.items() if k not in ("stage", "start", "wall", "cprofile")}} for r in report()]
+	with open(file_name, "w") as file:
+		json.dump({"traceEvents": events}, file, default=float)
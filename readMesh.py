@@ -0,0 +1,339 @@
+import os
+import mmap
+from contextlib import contextmanager
+from profiling import stage
+from numpy import arange, concatenate, count_nonzero, dtype, empty, flatnonzero, frombuffer, fromstring, int32, int64, uint8, unique, zeros
+
+# Number of nodes of the Gmsh element types (elementType: nodes).
+Element_nodes = {1: 2, 2: 3, 3: 4, 4: 4, 5: 8, 6: 6, 7: 5, 8: 3, 9: 6, 10: 9, 11: 10, 12: 27,
+				 13: 18, 14: 14, 15: 1, 16: 8, 17: 20, 18: 15, 19: 13, 29: 20, 30: 35}
+
+# Dimension of the physical groups of physicalTags {"fixed", "load", "body"}.
+Group_dims = {"fixed": 2, "load": 1, "body": 3}
+
+Line_window = 2**21		# Bytes scanned at once when skipping the lines of an ASCII section.
+
+def _section(buffer, name):
+	"""
+	Offsets (start, end) of the body of a $Name ... $EndName section, or None if the section is missing.
+	"""
+
+	start = buffer.find(b"$" + name + b"\n")
+	if start < 0:
+		start = buffer.find(b"$" + name + b"\r\n")
+		if start < 0:
+			return None
+
+	start = buffer.find(b"\n", start) + 1
+	end = buffer.find(b"$End" + name, start)
+	return (start, end)
+
+class _Reader:
+	"""
+	Cursor over a binary section of a .msh file.
+	"""
+
+	def __init__(self, buffer, offset, size_t):
+		self.buffer, self.offset = buffer, offset
+		self.size_t = dtype("<u8") if size_t == 8 else dtype("<u4")
+
+	def read(self, kind, count=1):
+		kind = {"int": dtype("<i4"), "double": dtype("<f8"), "size_t": self.size_t}[kind]
+		values = frombuffer(self.buffer, dtype=kind, count=count, offset=self.offset)
+		self.offset += kind.itemsize*count
+		return values
+
+def _entities(buffer, bounds, binary, size_t):
+	"""
+	Physical tags of every entity, keyed by (dim, tag).
+	"""
+
+	physical = {}
+	if bounds is None:
+		return physical
+
+	if binary:
+		r = _Reader(buffer, bounds[0], size_t)
+		counts = r.read("size_t", 4)
+		for dim in range(4):
+			for _ in range(int(counts[dim])):
+				tag = int(r.read("int")[0])
+				r.read("double", 3 if dim == 0 else 6)
+				physical[(dim, tag)] = [int(p) for p in r.read("int", int(r.read("size_t")[0]))]
+				if dim > 0:
+					r.read("int", int(r.read("size_t")[0]))
+		return physical
+
+	# The ASCII section is small (one line per entity), it is tokenized once and walked.
+	t = fromstring(bytes(buffer[bounds[0]:bounds[1]]), sep=" ")
+	counts, i = t[:4].astype(int64), 4
+	for dim in range(4):
+		for _ in range(int(counts[dim])):
+			tag = int(t[i])
+			i += 4 if dim == 0 else 7
+			n = int(t[i])
+			physical[(dim, tag)] = [int(p) for p in t[i+1:i+1+n]]
+			i += 1 + n
+			if dim > 0:
+				i += 1 + int(t[i])
+	return physical
+
+def _physicalNames(buffer, bounds):
+	"""
+	Physical group names, keyed by (dim, tag).
+	"""
+
+	names = {}
+	if bounds is None:
+		return names
+
+	lines = bytes(buffer[bounds[0]:bounds[1]]).decode().splitlines()
+	for line in lines[1:int(lines[0]) + 1]:
+		dim, tag, name = line.split(maxsplit=2)
+		names[(int(dim), int(tag))] = name.strip().strip('"')
+	return names
+
+def _nodes(buffer, bounds, binary, size_t):
+	"""
+	Nodal coordinates, stored by row (nodeTag - 1).
+	"""
+
+	if binary:
+		r = _Reader(buffer, bounds[0], size_t)
+		nblocks, _, _, maxTag = (int(v) for v in r.read("size_t", 4))
+		coords = zeros((maxTag, 3))
+		for _ in range(nblocks):
+			dim, _, parametric = (int(v) for v in r.read("int", 3))
+			n = int(r.read("size_t")[0])
+			tags = r.read("size_t", n).astype(int64)
+			width = 3 + (dim if parametric else 0)
+			coords[tags - 1] = r.read("double", n*width).reshape(n, width)[:, :3]
+		return coords
+
+	# The whole section is converted to numbers in C, only the blocks are walked in Python.
+	t = fromstring(bytes(buffer[bounds[0]:bounds[1]]), sep=" ")
+	nblocks, maxTag, i = int(t[0]), int(t[3]), 4
+	coords = zeros((maxTag, 3))
+	for _ in range(nblocks):
+		dim, parametric, n = int(t[i]), int(t[i+2]), int(t[i+3])
+		i += 4
+		tags = t[i:i+n].astype(int64)
+		i += n
+		width = 3 + (dim if parametric else 0)
+		coords[tags - 1] = t[i:i+n*width].reshape(n, width)[:, :3]
+		i += n*width
+	return coords
+
+def _elements(buffer, bounds, binary, size_t):
+	"""
+	Element blocks as a list of (dim, entityTag, elementType, elementTags, nodeTags).
+	"""
+
+	blocks = []
+	if binary:
+		r = _Reader(buffer, bounds[0], size_t)
+		nblocks = int(r.read("size_t", 4)[0])
+		for _ in range(nblocks):
+			dim, tag, kind = (int(v) for v in r.read("int", 3))
+			n = int(r.read("size_t")[0])
+			data = r.read("size_t", n*(1 + Element_nodes[kind])).astype(int64).reshape(n, -1)
+			blocks.append((dim, tag, kind, data[:, 0], data[:, 1:]))
+		return blocks
+
+	t = fromstring(bytes(buffer[bounds[0]:bounds[1]]), dtype=int64, sep=" ")
+	nblocks, i = int(t[0]), 4
+	for _ in range(nblocks):
+		dim, tag, kind, n = (int(v) for v in t[i:i+4])
+		i += 4
+		data = t[i:i+n*(1 + Element_nodes[kind])].reshape(n, -1)
+		i += data.size
+		blocks.append((dim, tag, kind, data[:, 0], data[:, 1:]))
+	return blocks
+
+@contextmanager
+def _mapped(file_name):
+	"""
+	Read-only memory map of a .msh 4.1 file, with its binary flag and size_t width.
+	"""
+
+	with open(file_name, "rb") as file:
+		buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+		try:
+			header = _section(buffer, b"MeshFormat")
+			version, binary, size_t = bytes(buffer[header[0]:buffer.find(b"\n", header[0])]).split()
+			assert version.startswith(b"4"), "Only the .msh 4.1 format is supported!"
+			yield (buffer, int(binary) == 1, int(size_t))
+		finally:
+			buffer.close()
+
+def _skipLines(buffer, offset, n, end):
+	"""
+	Offset just past the next n lines of an ASCII section. Newlines are counted Line_window bytes at a time, so the memory
+	does not depend on n, and only located in the window holding the last one.
+	"""
+
+	while n > 0 and offset < end:
+		stop = min(offset + Line_window, end)
+		newline = frombuffer(buffer, dtype=uint8, count=stop - offset, offset=offset) == 10
+		count = int(count_nonzero(newline))
+		if count >= n:
+			return offset + int(flatnonzero(newline)[n - 1]) + 1
+		n, offset = n - count, stop
+	return offset
+
+def _elementChunks(buffer, bounds, binary, size_t, block, elementType, solid):
+	"""
+	Same blocks as _elements, in pieces of at most block elements. Only the blocks of elementType (solid=True) or only the
+	other ones (solid=False) are converted, the rest are skipped without being parsed.
+	"""
+
+	if binary:
+		r = _Reader(buffer, bounds[0], size_t)
+		nblocks = int(r.read("size_t", 4)[0])
+		for _ in range(nblocks):
+			dim, tag, kind = (int(v) for v in r.read("int", 3))
+			n, width = int(r.read("size_t")[0]), 1 + Element_nodes[kind]
+			if (kind == elementType) != solid:
+				r.offset += n*width*r.size_t.itemsize
+				continue
+			for start in range(0, n, block):
+				data = r.read("size_t", min(block, n - start)*width).astype(int64).reshape(-1, width)
+				yield (dim, tag, kind, data[:, 0], data[:, 1:])
+		return
+
+	offset = buffer.find(b"\n", bounds[0]) + 1
+	nblocks = int(bytes(buffer[bounds[0]:offset]).split()[0])
+	for _ in range(nblocks):
+		end = buffer.find(b"\n", offset) + 1
+		dim, tag, kind, n = (int(v) for v in bytes(buffer[offset:end]).split())
+		offset = end
+		if (kind == elementType) != solid:
+			offset = _skipLines(buffer, offset, n, bounds[1])
+			continue
+		for start in range(0, n, block):
+			m = min(block, n - start)
+			end = _skipLines(buffer, offset, m, bounds[1])
+			data = fromstring(bytes(buffer[offset:end]), dtype=int64, sep=" ").reshape(m, -1)
+			offset = end
+			yield (dim, tag, kind, data[:, 0], data[:, 1:])
+
+def readMsh(file_name, elementType=11):
+	"""
+	Reads a Gmsh .msh 4.1 file (ASCII or binary) straight into NumPy arrays, without a gmsh session.
+
+	Inputs: file_name - path to the .msh file.
+			elementType - Gmsh type of the solid elements (11 = 10-node tetrahedron).
+
+	Outputs: dictionary with
+			 coords - nodal coordinates (Nnodesx3), row i holds node tag i+1.
+			 elements - 0-based connectivity of the solid elements (nex10, int32).
+			 elementTags - Gmsh tags of the solid elements (ne).
+			 groups - 0-based node indices of each physical group, keyed by (dim, tag) as physical tags are only unique
+					  within a dimension.
+			 elementGroups - rows of elements that belong to each physical group, keyed by (dim, tag).
+			 physicalGroups - (dim, tag) of every physical group of $Entities, sorted.
+			 physicalNames - names of the physical groups, keyed by (dim, tag) (only the named ones).
+	"""
+
+	with stage("mesh read") as counters, _mapped(file_name) as (buffer, binary, size_t):
+		physical = _entities(buffer, _section(buffer, b"Entities"), binary, size_t)
+		names = _physicalNames(buffer, _section(buffer, b"PhysicalNames"))
+		coords = _nodes(buffer, _section(buffer, b"Nodes"), binary, size_t)
+		blocks = _elements(buffer, _section(buffer, b"Elements"), binary, size_t)
+		counters.update(bytes=os.path.getsize(file_name), nodes=len(coords))
+
+	# ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+	index = int32 if len(coords) < 2**31 else int64
+	solid = [(tag, tags, nodes) for dim, tag, kind, tags, nodes in blocks if kind == elementType]
+	elements = concatenate([nodes for _, _, nodes in solid]).astype(index) - 1 if solid else empty((0, 10), dtype=index)
+	elementTags = concatenate([tags for _, tags, _ in solid]) if solid else empty(0, dtype=int64)
+
+	groupNodes, groupElements, offset = {}, {}, 0
+	for dim, tag, kind, tags, nodes in blocks:
+		for p in physical.get((dim, tag), []):
+			groupNodes.setdefault((dim, p), []).append(nodes.ravel() - 1)
+			if kind == elementType:
+				groupElements.setdefault((dim, p), []).append(arange(offset, offset + len(tags)))
+		if kind == elementType:
+			offset += len(tags)
+
+	groups = {p: unique(concatenate(v)).astype(index) for p, v in groupNodes.items()}
+	elementGroups = {p: concatenate(v) for p, v in groupElements.items()}
+
+	return {"coords": coords, "elements": elements, "elementTags": elementTags, "groups": groups, "elementGroups": elementGroups,
+			"physicalGroups": _physicalGroups(physical), "physicalNames": names}
+
+def readMshBoundary(file_name, elementType=11, block=100000):
+	"""
+	Same as readMsh without the solid elements, for meshes whose connectivity is streamed with elementBlocks.
+
+	Outputs: dictionary with coords, groups (nodes of the lower dimensional elements only, keyed by (dim, tag)),
+			 physicalGroups and physicalNames.
+	"""
+
+	groupNodes = {}
+	with stage("mesh read") as counters, _mapped(file_name) as (buffer, binary, size_t):
+		physical = _entities(buffer, _section(buffer, b"Entities"), binary, size_t)
+		names = _physicalNames(buffer, _section(buffer, b"PhysicalNames"))
+		coords = _nodes(buffer, _section(buffer, b"Nodes"), binary, size_t)
+		for dim, tag, kind, tags, nodes in _elementChunks(buffer, _section(buffer, b"Elements"), binary, size_t, block, elementType, False):
+			for p in physical.get((dim, tag), []):
+				groupNodes.setdefault((dim, p), []).append(unique(nodes) - 1)
+		counters.update(bytes=os.path.getsize(file_name), nodes=len(coords))
+
+	index = int32 if len(coords) < 2**31 else int64
+	groups = {p: unique(concatenate(v)).astype(index) for p, v in groupNodes.items()}
+	return {"coords": coords, "groups": groups, "physicalGroups": _physicalGroups(physical), "physicalNames": names}
+
+def elementBlocks(file_name, block=100000, elementType=11, physicalTag=None):
+	"""
+	Generator over the solid elements of a .msh 4.1 file, at most block elements at a time, so that the connectivity is
+	never held in memory as a whole.
+
+	Inputs: file_name - path to the .msh file.
+			block - number of elements per piece.
+			elementType - Gmsh type of the solid elements (11 = 10-node tetrahedron).
+			physicalTag - only the elements of this physical group of the solid dimension (every solid element if None).
+
+	Outputs: (elementTags, elements) pieces, elements holding the 0-based connectivity (int64).
+	"""
+
+	with _mapped(file_name) as (buffer, binary, size_t):
+		physical = _entities(buffer, _section(buffer, b"Entities"), binary, size_t)
+		for dim, tag, kind, tags, nodes in _elementChunks(buffer, _section(buffer, b"Elements"), binary, size_t, block, elementType, True):
+			if physicalTag is None or physicalTag in physical.get((dim, tag), []):
+				yield (tags, nodes - 1)
+
+def _physicalGroups(physical):
+	return sorted({(dim, p) for (dim, _), tags in physical.items() for p in tags})
+
+def defaultPhysicalTags(meshData):
+	"""
+	Same choice of physical groups as main.py: the lowest tagged curve, surface and volume groups of $Entities, named or
+	not. A mesh without a surface or a volume group raises a ValueError, one without a curve group is only loaded by its
+	body forces.
+	"""
+
+	byDim = {}
+	for dim, tag in meshData["physicalGroups"]:
+		byDim.setdefault(dim, tag)
+	physicalTags = {name: byDim.get(dim) for name, dim in Group_dims.items()}
+
+	missing = [name for name in ("fixed", "body") if physicalTags[name] is None]
+	if missing:
+		raise ValueError(f"No physical group for {' or '.join(missing)} ({', '.join(f'dim {Group_dims[m]}' for m in missing)})!")
+	return physicalTags
+
+def boundaryDOFs(meshData, physicalTags, DOFS=3):
+	"""
+	Restricted_DOF (every DOF of the fixed nodes) and Loaded_DOF (Y DOF of the loaded nodes), as built by accessMesh.
+	physicalTags holds plain tags, looked up in the dimension of Group_dims.
+	"""
+
+	fixed = meshData["groups"].get((Group_dims["fixed"], physicalTags["fixed"]), empty(0, dtype=int64)).astype(int64)
+	loaded = meshData["groups"].get((Group_dims["load"], physicalTags["load"]), empty(0, dtype=int64)).astype(int64)
+
+	Restricted_DOF = (DOFS*fixed[:, None] + arange(DOFS)).ravel()
+	Loaded_DOF = DOFS*loaded + 1
+	return (Restricted_DOF, Loaded_DOF)
@@ -0,0 +1,273 @@
+import os
+import sys
+import json
+import socket
+import asyncio
+import argparse
+from time import perf_counter
+from collections import OrderedDict, deque
+from numpy import abs as absolute, arange, asarray, percentile, sqrt
+from systemCache import loadSystem
+from loadCases import Factorization, bodyForceWeights, loadCaseMatrix
+from getStress import stressField, vonMises
+
+# ----------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Resident solver service. Requests and responses are JSON objects, one per line, over a Unix socket or a localhost TCP
+# port. A model (mesh + E + nu) is assembled and factored once and kept warm, later requests only pay for the force
+# vector, two triangular solves and the stress recovery. Requests that arrive within Batch_window of each other and use
+# the same model are solved together as the columns of one right hand side.
+#
+#	{"op": "solve", "id": 1, "mesh": "cantileverBeam.msh", "E": 200e9, "nu": 0.3, "f": -1000, "by": -76930,
+#	 "nodal": {"42": [0, -500, 0]}, "U": false}
+#	{"op": "load", "mesh": ..., "E": ..., "nu": ...}		warms a model without solving.
+#	{"op": "stats"}											counters and latency percentiles.
+#	{"op": "shutdown"}
+# ----------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+Max_models = 2			# Models kept warm, least recently used are evicted first.
+Batch_window = 0.002	# Seconds a batch stays open for more requests.
+Max_batch = 64			# Load cases solved at once.
+
+class Model:
+	"""
+	Assembled system of a mesh and material with the factorization of Kff and the body force weights.
+	"""
+
+	def __init__(self, file_name, E, nu, physicalTags=None, cache_dir=None):
+		start = perf_counter()
+		# Body forces come with every request, the stiffness only depends on E and nu.
+		self.properties = {"E": E, "nu": nu, "bx": 0, "by": 0, "bz": 0}
+		self.system = loadSystem(file_name, self.properties, physicalTags, cache_dir=cache_dir)
+		self.factorization = Factorization(self.system["K"], self.system["Restricted_DOF"])
+		self.weights = bodyForceWeights(self.system["elements"], self.system["coords"])
+		self.load_time = perf_counter() - start
+
+	def forces(self, cases, DOFS=3):
+		"""
+		Force vectors (3Nxncases) of the load cases: point load f on Loaded_DOF, body force (bx, by, bz) and nodal loads
+		{nodeTag: [Fx, Fy, Fz]}.
+		"""
+
+		F = loadCaseMatrix(self.weights, self.system["Loaded_DOF"], cases, DOFS)
+		Nnodes = len(self.system["coords"])
+		for i, case in enumerate(cases):
+			for tag, values in case.get("nodal", {}).items():
+				if not 1 <= int(tag) <= Nnodes or len(values) > DOFS:
+					raise ValueError(f"Nodal load {tag}: {values} is not a node tag (1 to {Nnodes}) with at most {DOFS} components!")
+				F[DOFS*(int(tag) - 1) + arange(len(values)), i] += values
+		return F
+
+	def solve(self, cases):
+		U = self.factorization.solve(self.forces(cases))
+		_, σ = stressField(self.system["elements"], U, self.system["coords"], self.properties)
+		return (U, σ)
+
+def _summary(U, σ, wantU, DOFS=3):
+	Un = U.reshape(-1, DOFS)
+	result = {"maxDisplacement": float(sqrt((Un**2).sum(axis=1)).max(initial=0)),
+			  "maxVonMises": float(vonMises(σ).max(initial=0)),
+			  "maxStress": absolute(σ).max(axis=(0, 1), initial=0).tolist()}
+	if wantU:
+		result["U"] = U.tolist()
+	return result
+
+class SolverServer:
+	"""
+	asyncio front end with a bounded model cache and request batching.
+	"""
+
+	def __init__(self, max_models=Max_models, batch_window=Batch_window, max_batch=Max_batch, cache_dir=None):
+		self.max_models, self.batch_window, self.max_batch, self.cache_dir = max_models, batch_window, max_batch, cache_dir
+		self.models, self._loading = OrderedDict(), {}
+		self.latencies = deque(maxlen=10000)
+		self.counters = {"requests": 0, "cases": 0, "batches": 0, "hits": 0, "misses": 0, "evictions": 0, "errors": 0}
+		self._queue = self._closed = None
+
+	async def model(self, request):
+		key = json.dumps([request["mesh"], request["E"], request["nu"], request.get("physicalTags")], sort_keys=True)
+		if key in self.models:
+			self.counters["hits"] += 1
+			self.models.move_to_end(key)
+			return (key, self.models[key])
+
+		# Concurrent requests for a model that is still loading wait for the same assembly.
+		if key not in self._loading:
+			self.counters["misses"] += 1
+			self._loading[key] = asyncio.get_running_loop().run_in_executor(
+				None, Model, request["mesh"], request["E"], request["nu"], request.get("physicalTags"), self.cache_dir)
+			try:
+				model = await self._loading[key]
+			finally:
+				self._loading.pop(key)
+			self.models[key] = model
+			while len(self.models) > self.max_models:
+				self.models.popitem(last=False)
+				self.counters["evictions"] += 1
+			return (key, model)
+
+		return (key, await self._loading[key])
+
+	async def _batches(self):
+		loop = asyncio.get_running_loop()
+		while True:
+			batch = [await self._queue.get()]
+			deadline = loop.time() + self.batch_window
+			while len(batch) < self.max_batch and loop.time() < deadline:
+				try:
+					batch.append(await asyncio.wait_for(self._queue.get(), deadline - loop.time()))
+				except asyncio.TimeoutError:
+					break
+
+			groups = {}
+			for item in batch:
+				groups.setdefault(item[0], []).append(item)
+
+			for items in groups.values():
+				self.counters["batches"] += 1
+				try:
+					await self._solveBatch(items)
+				except Exception as error:
+					if len(items) == 1:
+						items[0][3].set_exception(error)
+						continue
+					# One bad case (an unknown node tag, a missing value) must not fail the requests it was batched with, the
+					# cases are solved one by one and only the offending ones get the error.
+					for item in items:
+						try:
+							await self._solveBatch([item])
+						except Exception as caseError:
+							item[3].set_exception(caseError)
+
+	async def _solveBatch(self, items):
+		start = perf_counter()
+		U, σ = await asyncio.get_running_loop().run_in_executor(None, items[0][1].solve, [case for _, _, case, _ in items])
+		elapsed = perf_counter() - start
+		for i, (*_, future) in enumerate(items):
+			future.set_result((U[:, i], σ[..., i], len(items), elapsed))
+
+	async def solve(self, request):
+		start = perf_counter()
+		key, model = await self.model(request)
+		loaded = perf_counter()
+
+		cases = request.get("cases", [request])
+		futures = [asyncio.get_running_loop().create_future() for _ in cases]
+		for case, future in zip(cases, futures):
+			self._queue.put_nowait((key, model, case, future))
+		results = await asyncio.gather(*futures)
+
+		response = [_summary(U, σ, request.get("U", False)) for U, σ, _, _ in results]
+		total = perf_counter() - start
+		self.counters["cases"] += len(cases)
+		self.latencies.append(total)
+		return {**(response[0] if "cases" not in request else {"cases": response}),
+				"latency": {"model_ms": 1e3*(loaded - start), "solve_ms": 1e3*max(r[3] for r in results), "total_ms": 1e3*total},
+				"batch": max(r[2] for r in results)}
+
+	def stats(self):
+		latencies = 1e3*asarray(self.latencies) if self.latencies else asarray([0.])
+		p50, p95, p99 = percentile(latencies, [50, 95, 99])
+		return {**self.counters, "models": list(self.models),
+				"latency_ms": {"p50": p50, "p95": p95, "p99": p99, "max": latencies.max(), "mean": latencies.mean()}}
+
+	async def handle(self, request):
+		self.counters["requests"] += 1
+		op = request.get("op", "solve")
+		try:
+			if op == "solve":
+				response = await self.solve(request)
+			elif op == "load":
+				_, model = await self.model(request)
+				response = {"load_ms": 1e3*model.load_time, "dofs": model.system["K"].shape[0]}
+			elif op == "stats":
+				response = self.stats()
+			elif op == "shutdown":
+				self._closed.set()
+				response = {}
+			else:
+				raise ValueError(f"Unknown op '{op}'!")
+		except Exception as error:
+			self.counters["errors"] += 1
+			response = {"error": f"{type(error).__name__}: {error}"}
+		return {"id": request.get("id"), **response}
+
+	async def _connection(self, reader, writer):
+		async def respond(line):
+			try:
+				response = await self.handle(json.loads(line))
+			except json.JSONDecodeError as error:
+				response = {"error": f"JSONDecodeError: {error}"}
+			writer.write((json.dumps(response, default=float) + "\n").encode())
+			await writer.drain()
+
+		# Every line is handled in its own task, so that pipelined requests of one client are batched together.
+		tasks = set()
+		try:
+			async for line in reader:
+				if line.strip():
+					task = asyncio.create_task(respond(line))
+					tasks.add(task)
+					task.add_done_callback(tasks.discard)
+			await asyncio.gather(*tasks)
+		except asyncio.CancelledError:
+			# Connections still open at shutdown.
+			pass
+		finally:
+			writer.close()
+
+	async def serve(self, address):
+		"""
+		Serves until a shutdown request. address - path of a Unix socket, or (host, port).
+		"""
+
+		self._queue, self._closed = asyncio.Queue(), asyncio.Event()
+		if isinstance(address, str):
+			server = await asyncio.start_unix_server(self._connection, path=address)
+		else:
+			server = await asyncio.start_server(self._connection, *address)
+
+		batches = asyncio.create_task(self._batches())
+		try:
+			async with server:
+				await self._closed.wait()
+		finally:
+			batches.cancel()
+			if isinstance(address, str) and os.path.exists(address):
+				os.remove(address)
+
+class Client:
+	"""
+	Blocking client over one persistent connection, for optimization loops.
+	"""
+
+	def __init__(self, address):
+		family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+		self.socket = socket.socket(family, socket.SOCK_STREAM)
+		self.socket.connect(address)
+		self.file = self.socket.makefile("rwb")
+
+	def request(self, **message):
+		self.file.write((json.dumps(message) + "\n").encode())
+		self.file.flush()
+		return json.loads(self.file.readline())
+
+	def close(self):
+		self.file.close()
+		self.socket.close()
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Resident Tet10 solver service (JSON lines).")
+	parser.add_argument("--socket", help="Path of the Unix socket.")
+	parser.add_argument("--port", type=int, help="Localhost TCP port (used when there is no --socket).")
+	parser.add_argument("--max-models", type=int, default=Max_models, help=f"Models kept warm ({Max_models}).")
+	parser.add_argument("--batch-window", type=float, default=Batch_window, help=f"Seconds a batch waits for more requests ({Batch_window}).")
+	parser.add_argument("--max-batch", type=int, default=Max_batch, help=f"Load cases solved at once ({Max_batch}).")
+	parser.add_argument("--cache-dir", help="Reuse assembled systems from this cache directory.")
+	args = parser.parse_args(argv)
+
+	address = args.socket or ("127.0.0.1", args.port or 8765)
+	server = SolverServer(args.max_models, args.batch_window, args.max_batch, args.cache_dir)
+	asyncio.run(server.serve(address))
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,85 @@
+from time import perf_counter
+from numpy import add, asarray, dot, einsum, eye, sqrt, unique, zeros
+from numpy.linalg import inv
+
+def jacobiPreconditioner(A):
+	"""
+	Diagonal (Jacobi) preconditioner of a sparse matrix.
+	"""
+
+	d = 1/A.diagonal()
+	return lambda r: d*r
+
+def blockJacobiPreconditioner(A, dofs, DOFS=3):
+	"""
+	Block-Jacobi preconditioner that inverts the DOFSxDOFS block of every node.
+
+	Inputs: A - sparse matrix in the reduced (free DOF) numbering.
+			dofs - global DOF number of every row of A.
+	"""
+
+	dofs = asarray(dofs)
+	node, local = dofs//DOFS, dofs % DOFS
+	_, group = unique(node, return_inverse=True)
+
+	# Blocks start as the identity so that nodes with constrained DOFs are padded with ones on the diagonal.
+	blocks = zeros((group.max(initial=-1) + 1, DOFS, DOFS))
+	blocks[:] = eye(DOFS)
+	blocks[group, local, local] = 0
+
+	A = A.tocoo()
+	same = group[A.row] == group[A.col]
+	add.at(blocks, (group[A.row[same]], local[A.row[same]], local[A.col[same]]), A.data[same])
+	blocks = inv(blocks)
+
+	def apply(r):
+		padded = zeros(blocks.shape[:2])
+		padded[group, local] = r
+		return einsum("nij,nj->ni", blocks, padded)[group, local]
+
+	return apply
+
+def pcg(A, b, M=None, x0=None, tol=1e-8, maxiter=None):
+	"""
+	Preconditioned conjugate gradient.
+
+	Inputs: A - symmetric positive definite matrix or LinearOperator.
+			b - right hand side.
+			M - preconditioner, callable returning M^-1 r.
+			x0 - initial guess (warm start).
+			tol - relative tolerance on the residual norm, ||r|| <= tol*||b||.
+			maxiter - maximum number of iterations (10 times the size of the system by default).
+
+	Outputs: x - solution.
+			 info - dictionary with the iterations, the residual history, the wall time and whether it converged.
+	"""
+
+	start = perf_counter()
+	n = len(b)
+	maxiter = 10*n if maxiter is None else maxiter
+	M = (lambda r: r) if M is None else M
+
+	x = zeros(n) if x0 is None else asarray(x0, dtype=float).copy()
+	r = b - A @ x if x0 is not None else b.copy()
+	norm_b = sqrt(dot(b, b)) or 1.0
+	residuals = [sqrt(dot(r, r))/norm_b]
+
+	# ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+	z = M(r)
+	p = z.copy()
+	rz = dot(r, z)
+	k = 0
+	while residuals[-1] > tol and k < maxiter:
+		Ap = A @ p
+		α = rz/dot(p, Ap)
+		x += α*p
+		r -= α*Ap
+		residuals.append(sqrt(dot(r, r))/norm_b)
+
+		z = M(r)
+		rz, rz_old = dot(r, z), rz
+		p = z + (rz/rz_old)*p
+		k += 1
+
+	return (x, {"iterations": k, "residuals": residuals, "time": perf_counter() - start, "converged": residuals[-1] <= tol})
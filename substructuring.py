@@ -0,0 +1,157 @@
+import os
+from time import perf_counter
+from multiprocessing import Pipe, Process
+from accessMesh import assembleStiffness
+from solvers import pcg, jacobiPreconditioner
+from profiling import stage
+from numpy import arange, argsort, asarray, bincount, broadcast_to, concatenate, flatnonzero, full, int64, unique, zeros
+from scipy.sparse import coo_matrix
+from scipy.sparse.linalg import splu
+
+# ----------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Schur complement substructuring. The elements are split into subdomains by recursive coordinate bisection of their
+# centroids, and every subdomain lives in its own process: it assembles its stiffness, condenses its interior DOFs onto the
+# interface (S = Kbb - Kbi Kii^-1 Kib, g = fb - Kbi Kii^-1 fi) and keeps the Kii factorization until the interface
+# displacements come back. Subdomains only exchange S, g and ub with the main process through pipes, so they could as well
+# run on other machines.
+# ----------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+Column_block = 256		# Interface columns condensed per solve with the interior factorization.
+
+def bisectElements(nodes, coords, parts):
+	"""
+	Subdomain of every element (ne), by recursive bisection of the element centroids along their longest extent. The
+	number of elements of every part is proportional to its share of parts, so parts need not be a power of two.
+	"""
+
+	centroids = asarray(coords, dtype=float)[asarray(nodes)[:, :4]].mean(axis=1)
+	part = zeros(len(centroids), dtype=int64)
+
+	def split(elements, first, count):
+		if count == 1 or len(elements) == 0:
+			part[elements] = first
+			return
+		c = centroids[elements]
+		axis = (c.max(axis=0) - c.min(axis=0)).argmax()
+		elements = elements[argsort(c[:, axis], kind="stable")]
+		half = count//2
+		cut = len(elements)*half//count
+		split(elements[:cut], first, half)
+		split(elements[cut:], first + half, count - half)
+
+	split(arange(len(centroids)), 0, parts)
+	return part
+
+def _subdomain(connection, nodes, coords, properties, interior, boundary, fi, DOFS):
+	"""
+	Worker process of one subdomain (local numbering). Sends (S, g, volume), waits for ub and sends back ui.
+	"""
+
+	K, F, volume = assembleStiffness(nodes, coords, properties, DOFS)
+	Kii, Kib, Kbb = K[interior][:, interior], K[interior][:, boundary].tocsc(), K[boundary][:, boundary]
+	lu = splu(Kii.tocsc())
+	fi = F[interior] + fi
+
+	# Kii^-1 Kib is only ever held Column_block columns at a time.
+	S = Kbb.toarray()
+	for first in range(0, len(boundary), Column_block):
+		columns = slice(first, first + Column_block)
+		S[:, columns] -= Kib.T @ lu.solve(Kib[:, columns].toarray())
+	connection.send((S, F[boundary] - Kib.T @ lu.solve(fi), volume))
+	del S
+
+	ub = connection.recv()
+	connection.send(lu.solve(fi - Kib @ ub))
+	connection.close()
+
+def substructureSolve(nodes, coords, properties, Restricted_DOF, Loaded_DOF, f, parts=None, interface="direct", tol=1e-10, maxiter=None, info=None, DOFS=3):
+	"""
+	Displacements by Schur complement substructuring, without assembling the global K.
+
+	Inputs: nodes - 0-based node connectivity (nex10).
+			coords - nodal coordinates (Nnodesx3).
+			properties - dictionary of material properties.
+			Restricted_DOF - constrained DOFs (zero displacement).
+			Loaded_DOF - DOFs that receive the point load f.
+			parts - number of subdomains (and worker processes), os.cpu_count() if None.
+			interface - "direct" (sparse LU) or "cg" (Jacobi preconditioned CG) for the interface system.
+			info - optional dictionary that receives the partition sizes, the time of every phase and the volume.
+
+	Outputs: U - displacements (3N).
+	"""
+
+	nodes, coords = asarray(nodes), asarray(coords, dtype=float)
+	Nnodes, ndof = len(coords), DOFS*len(coords)
+	parts = max(1, min(parts or os.cpu_count() or 1, len(nodes)))
+
+	P = zeros(ndof)
+	P[unique(asarray(Loaded_DOF, dtype=int64))] += f
+	constrained = full(ndof, False)
+	constrained[asarray(Restricted_DOF, dtype=int64).ravel()] = True
+
+	with stage("partition", parts=parts):
+		part = bisectElements(nodes, coords, parts)
+		# Nodes used by more than one subdomain form the interface.
+		pairs = unique(nodes.astype(int64)*parts + part[:, None])
+		shared = bincount(pairs//parts, minlength=Nnodes) > 1
+		dofShared = broadcast_to(shared[:, None], (Nnodes, DOFS)).ravel()
+		interfaceDOF = flatnonzero(dofShared & ~constrained)
+		ieq = full(ndof, -1, dtype=int64)
+		ieq[interfaceDOF] = arange(len(interfaceDOF))
+
+	workers, subdomains = [], []
+	start = perf_counter()
+	with stage("condensation"):
+		for s in range(parts):
+			e = nodes[part == s]
+			local = unique(e)
+			dofs = (DOFS*local[:, None] + arange(DOFS)).ravel()
+			free = ~constrained[dofs]
+			interior, boundary = flatnonzero(free & ~dofShared[dofs]), flatnonzero(free & dofShared[dofs])
+			renumber = full(Nnodes, -1, dtype=int64)
+			renumber[local] = arange(len(local))
+
+			parent, child = Pipe()
+			worker = Process(target=_subdomain, args=(child, renumber[e], coords[local], properties, interior, boundary, P[dofs[interior]], DOFS), daemon=True)
+			worker.start()
+			child.close()
+			workers.append((worker, parent))
+			subdomains.append((dofs[interior], ieq[dofs[boundary]]))
+
+		rows, cols, values = [], [], []
+		g, volume = P[interfaceDOF].copy(), 0.
+		for (_, connection), (_, b) in zip(workers, subdomains):
+			S, gs, v = connection.recv()
+			volume += v
+			rows.append(broadcast_to(b[:, None], S.shape).ravel())
+			cols.append(broadcast_to(b[None, :], S.shape).ravel())
+			values.append(S.ravel())
+			g += bincount(b, weights=gs, minlength=len(interfaceDOF))
+	condensed = perf_counter()
+
+	with stage("interface solve", dofs=len(interfaceDOF)) as counters:
+		n = len(interfaceDOF)
+		S = coo_matrix((concatenate(values), (concatenate(rows), concatenate(cols))), shape=(n, n)).tocsr()
+		if interface == "direct":
+			ub, report = splu(S.tocsc()).solve(g) if n else zeros(0), {"iterations": 0}
+		elif interface == "cg":
+			ub, report = pcg(S, g, M=jacobiPreconditioner(S), tol=tol, maxiter=maxiter)
+		else:
+			raise ValueError(f"Unknown interface solver '{interface}'!")
+		counters.update(nnz=S.nnz, iterations=report["iterations"])
+	solved = perf_counter()
+
+	U = zeros(ndof)
+	U[interfaceDOF] = ub
+	with stage("interior recovery"):
+		for (_, connection), (_, b) in zip(workers, subdomains):
+			connection.send(ub[b])
+		for (worker, connection), (i, _) in zip(workers, subdomains):
+			U[i] = connection.recv()
+			worker.join()
+
+	if info is not None:
+		info.update(parts=parts, interface_dofs=len(interfaceDOF), interior_dofs=[len(i) for i, _ in subdomains],
+					condensation=condensed - start, interface=solved - condensed, recovery=perf_counter() - solved,
+					iterations=report["iterations"], volume=volume)
+	return U
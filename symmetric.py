@@ -0,0 +1,150 @@
+from tet10 import Tet10Batch
+from profiling import stage
+from accessMesh import elementDOFs
+from numpy import abs as absolute, arange, asarray, bincount, broadcast_to, empty_like, sqrt, zeros
+from scipy.linalg import cholesky_banded, cho_solve_banded
+from scipy.sparse import coo_matrix, triu
+from scipy.sparse.csgraph import reverse_cuthill_mckee
+from scipy.sparse.linalg import LinearOperator, splu
+
+# Banded storage is kept while the reverse Cuthill-McKee bandwidth stays below Band_limit sqrt(n). On box meshes the band
+# factor is the smaller one up to about 5 sqrt(n) (a 10:1 beam) and already 25% larger than the SuperLU factors at
+# 20 sqrt(n) (a cube), where the band grows as n^(2/3) instead of the cross-section.
+Band_limit = 8
+
+def assembleUpper(nodes, coords, properties, DOFS=3):
+	"""
+	Same as assembleStiffness, but only the upper triangle of K is kept (465 of the 900 triplets of every element).
+
+	Outputs: Ku - upper triangle of K, diagonal included (CSR).
+			 F - global force vector.
+			 volume - total volume.
+	"""
+
+	nodes = asarray(nodes)
+	ndof = DOFS*len(coords)
+	with stage("integration", elements=len(nodes)):
+		ke, fe, vol = Tet10Batch(asarray(coords, dtype=float)[nodes], properties)
+
+	with stage("scatter"):
+		d = elementDOFs(nodes, DOFS)
+		F = bincount(d.ravel(), weights=fe.ravel(), minlength=ndof)
+		rows, cols = broadcast_to(d[:, :, None], ke.shape), broadcast_to(d[:, None, :], ke.shape)
+		upper = rows <= cols
+
+	with stage("csr conversion") as counters:
+		Ku = coo_matrix((ke[upper], (rows[upper], cols[upper])), shape=(ndof, ndof)).tocsr()
+		counters["nnz"] = Ku.nnz
+
+	return (Ku, F, vol.sum())
+
+def upperTriangle(K):
+	"""
+	Upper triangle (diagonal included) of a full symmetric matrix.
+	"""
+
+	return triu(K, format="csr")
+
+class SymmetricOperator(LinearOperator):
+	"""
+	Product with a symmetric matrix stored as its upper triangle: K x = U x + U^T x - diag(U) x.
+	"""
+
+	def __init__(self, Ku):
+		self.Ku = Ku.tocsr()
+		self._diagonal = self.Ku.diagonal()
+		super().__init__(dtype=float, shape=Ku.shape)
+
+	def _matvec(self, x):
+		x = asarray(x).ravel()
+		return self.Ku @ x + self.Ku.T @ x - self._diagonal*x
+
+	def _rmatvec(self, x):
+		return self._matvec(x)
+
+	def diagonal(self):
+		return self._diagonal.copy()
+
+def symmetricBlocks(Ku, free_dof, Restricted_DOF):
+	"""
+	Upper triangle of Kff and the full Kfc block, from the upper triangle of K (free_dof must be sorted).
+	"""
+
+	Ku = Ku.tocsr()
+	Kff = Ku[free_dof][:, free_dof]
+	Kfc = Ku[free_dof][:, Restricted_DOF] + Ku[Restricted_DOF][:, free_dof].T
+	return (Kff, Kfc.tocsr())
+
+class BandedCholesky:
+	"""
+	Cholesky factorization K = R^T R of a symmetric positive definite matrix given by its upper triangle.
+
+	The equations are first put in reverse Cuthill-McKee order and the factor is stored in LAPACK's symmetric band format
+	((bandwidth+1) x n), so only one triangle of the matrix and of the factor is ever held in memory.
+	"""
+
+	def __init__(self, Ku, perm=None):
+		Ku = Ku.tocsr()
+		n = Ku.shape[0]
+		self.perm = reverse_cuthill_mckee((Ku + Ku.T).tocsr(), symmetric_mode=True) if perm is None else perm
+		P = Ku[self.perm][:, self.perm].tocoo()
+
+		# After the permutation some entries land below the diagonal, they are mirrored to the upper triangle.
+		row, col = P.row.copy(), P.col.copy()
+		lower = row > col
+		row[lower], col[lower] = P.col[lower], P.row[lower]
+
+		self.bandwidth = int((col - row).max(initial=0))
+		ab = zeros((self.bandwidth + 1, n))
+		ab[self.bandwidth + row - col, col] = P.data
+		self.factor = cholesky_banded(ab, overwrite_ab=True, lower=False, check_finite=False)
+
+	def nbytes(self):
+		return self.factor.nbytes
+
+	def solve(self, b):
+		b = asarray(b, dtype=float)
+		x = zeros(b.shape)
+		x[self.perm] = cho_solve_banded((self.factor, False), b[self.perm], check_finite=False)
+		return x
+
+def bandwidth(Ku, perm):
+	"""
+	Bandwidth of the symmetric matrix of upper triangle Ku with its equations in the order perm.
+	"""
+
+	Ku = Ku.tocoo()
+	position = empty_like(perm)
+	position[perm] = arange(len(perm))
+	return int(absolute(position[Ku.row] - position[Ku.col]).max(initial=0))
+
+class SymmetricFactorization:
+	"""
+	Factorization of a symmetric positive definite matrix given by its upper triangle: banded Cholesky in reverse
+	Cuthill-McKee order while the bandwidth is below band_limit sqrt(n), otherwise SuperLU in symmetric mode with a
+	minimum degree ordering of A^T + A, which bounds the fill of meshes that are not slender.
+
+	Attributes: method - "banded" or "superlu".
+				bandwidth - reverse Cuthill-McKee bandwidth.
+	"""
+
+	def __init__(self, Ku, band_limit=Band_limit):
+		Ku = Ku.tocsr()
+		n = Ku.shape[0]
+		perm = reverse_cuthill_mckee((Ku + Ku.T).tocsr(), symmetric_mode=True)
+		self.bandwidth = bandwidth(Ku, perm)
+
+		if self.bandwidth <= band_limit*sqrt(n):
+			self.method, self._banded = "banded", BandedCholesky(Ku, perm)
+		else:
+			A = Ku + triu(Ku, 1).T
+			self.method, self._lu = "superlu", splu(A.tocsc(), permc_spec="MMD_AT_PLUS_A", diag_pivot_thresh=0,
+													 options={"SymmetricMode": True})
+
+	def nbytes(self):
+		if self.method == "banded":
+			return self._banded.nbytes()
+		return sum(M.data.nbytes + M.indices.nbytes + M.indptr.nbytes for M in (self._lu.L, self._lu.U))
+
+	def solve(self, b):
+		return self._banded.solve(b) if self.method == "banded" else self._lu.solve(asarray(b, dtype=float))
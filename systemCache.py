@@ -0,0 +1,177 @@
+import os
+import json
+import shutil
+import tempfile
+from hashlib import sha256
+from readMesh import readMsh, defaultPhysicalTags, boundaryDOFs, Group_dims
+from accessMesh import assembleStiffness
+from parallel import parallelAssembly, Chunk_size
+from dofNumbering import assembleReduced, renumberNodes, equationNumbering
+from symmetric import assembleUpper, upperTriangle
+from meshQuality import checkMesh
+from numpy import array, ix_, load, save
+from scipy.sparse import csr_matrix
+
+Cache_dir = ".tet10cache"
+Cache_bytes = 2**30		# Size limit of the cache directory, least recently used entries are removed first.
+
+Arrays = ("F", "coords", "elements", "elementTags", "Restricted_DOF", "Loaded_DOF", "flipped")
+Matrices = ("K", "Kff", "Kfc")		# Sparse matrices of a system, K is None for a reduced one.
+
+def cacheKey(file_name, properties, physicalTags, reduced=False, symmetric=False):
+	"""
+	Hash of the mesh file contents, the material/body force dictionary, the physical group tags and the layout of the
+	system.
+	"""
+
+	h = sha256()
+	with open(file_name, "rb") as file:
+		for block in iter(lambda: file.read(2**24), b""):
+			h.update(block)
+	layout = {"reduced": reduced, "symmetric": symmetric}
+	h.update(json.dumps({"properties": properties, "physicalTags": physicalTags, **layout}, sort_keys=True, default=float).encode())
+	return h.hexdigest()
+
+def _entries(cache_dir):
+	if not os.path.isdir(cache_dir):
+		return []
+	paths = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if not name.startswith(".")]
+	return [p for p in paths if os.path.isdir(p)]
+
+def _size(path):
+	return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+def evict(cache_dir=Cache_dir, max_bytes=Cache_bytes):
+	"""
+	Removes the least recently used entries until the cache fits in max_bytes.
+	"""
+
+	entries = sorted(_entries(cache_dir), key=os.path.getmtime)
+	sizes = [_size(p) for p in entries]
+	total = sum(sizes)
+	for path, size in zip(entries, sizes):
+		if total <= max_bytes:
+			break
+		shutil.rmtree(path, ignore_errors=True)
+		total -= size
+
+def clearCache(cache_dir=Cache_dir, key=None):
+	"""
+	Invalidates one entry (key) or the whole cache.
+	"""
+
+	if key is not None:
+		shutil.rmtree(os.path.join(cache_dir, key), ignore_errors=True)
+	elif os.path.isdir(cache_dir):
+		shutil.rmtree(cache_dir, ignore_errors=True)
+
+def _store(path, system):
+	arrays = {name: system[name] for name in Arrays + ("free_dof",) if name in system}
+	for name in Matrices:
+		if system.get(name) is not None:
+			M = system[name]
+			arrays.update({name + "_data": M.data, name + "_indices": M.indices, name + "_indptr": M.indptr, name + "_shape": array(M.shape)})
+
+	# Entries are written to a temporary directory and renamed, so that a crash never leaves a half written entry.
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	tmp = tempfile.mkdtemp(prefix=".tmp", dir=os.path.dirname(path))
+	for name, values in arrays.items():
+		save(os.path.join(tmp, name + ".npy"), values)
+	save(os.path.join(tmp, "scalars.npy"), array([system["volume"]]))
+	try:
+		os.replace(tmp, path)
+	except OSError:
+		shutil.rmtree(tmp, ignore_errors=True)
+
+def _load(path):
+	a = {name[:-4]: load(os.path.join(path, name), mmap_mode="r") for name in os.listdir(path) if name != "scalars.npy"}
+	for name in Matrices:
+		if name + "_shape" in a:
+			a[name] = csr_matrix((a.pop(name + "_data"), a.pop(name + "_indices"), a.pop(name + "_indptr")),
+								 shape=tuple(int(n) for n in a.pop(name + "_shape")), copy=False)
+	a.setdefault("K", None)
+	a["volume"] = float(load(os.path.join(path, "scalars.npy"))[0])
+
+	# deformedShape adds the point loads to F in place, so F is the only array read into memory.
+	a["F"] = array(a["F"])
+	return a
+
+def readSystem(file_name, physicalTags=None, DOFS=3):
+	"""
+	Everything loadSystem returns except K, F and volume: coords, elements and elementTags of the body group,
+	Restricted_DOF and Loaded_DOF, plus the checkMesh report (quality). Inverted elements come back reordered, their rows
+	in flipped (fileOrder restores the node order of the file), and a ValueError is raised before any assembly if invalid
+	ones remain.
+	"""
+
+	meshData = readMsh(file_name)
+	physicalTags = defaultPhysicalTags(meshData) if physicalTags is None else physicalTags
+	body = meshData["elementGroups"].get((Group_dims["body"], physicalTags["body"]))
+	elements = meshData["elements"] if body is None else meshData["elements"][body]
+	elementTags = meshData["elementTags"] if body is None else meshData["elementTags"][body]
+
+	elements, quality = checkMesh(elements, meshData["coords"])
+	Restricted_DOF, Loaded_DOF = boundaryDOFs(meshData, physicalTags, DOFS)
+	return {"coords": meshData["coords"], "elements": elements, "elementTags": elementTags,
+			"Restricted_DOF": Restricted_DOF, "Loaded_DOF": Loaded_DOF, "flipped": quality["flipped"], "quality": quality}
+
+def loadSystem(file_name, properties, physicalTags=None, cache_dir=Cache_dir, max_bytes=Cache_bytes, workers=None, mode="thread",
+			   chunk=Chunk_size, reduced=False, symmetric=False, DOFS=3):
+	"""
+	Assembled system of a mesh, taken from the on-disk cache when neither the mesh nor the properties changed.
+
+	Inputs: file_name - path to the .msh file.
+			properties - dictionary of material properties.
+			physicalTags - {"fixed", "load", "body"} tags (defaultPhysicalTags if None).
+			cache_dir - cache directory (None disables the cache).
+			max_bytes - size limit of the cache directory.
+			workers - threads or processes of the element integration (parallelAssembly, 0 for one per core), serial if None.
+			mode, chunk - parallelAssembly mode ("thread" or "process") and elements per task.
+			reduced - assemble Kff and Kfc in reverse Cuthill-McKee equation order (assembleReduced) instead of K.
+			symmetric - only keep the upper triangle of K (assembleUpper), for deformedShape(symmetric=True).
+
+	Outputs: dictionary with K (CSR), F, coords, elements, elementTags, Restricted_DOF, Loaded_DOF, flipped and volume. A reduced
+			 system has K = None and Kff, Kfc and free_dof instead, its Restricted_DOF being sorted without duplicates.
+			 On a hit the arrays are memory-mapped (read-only) from the cache and no assembly is done.
+	"""
+
+	# A None physicalTags (the default groups) is part of the key as is, since the defaults only depend on the file contents.
+	key = None
+	if cache_dir is not None:
+		key = cacheKey(file_name, properties, physicalTags, reduced, symmetric)
+		path = os.path.join(cache_dir, key)
+		if os.path.isdir(path):
+			# Entries without the flipped rows cannot restore the node order of the file, they are rebuilt.
+			if os.path.exists(os.path.join(path, "flipped.npy")):
+				os.utime(path)
+				return _load(path)
+			clearCache(cache_dir, key)
+
+	# ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+	system = readSystem(file_name, physicalTags, DOFS)
+	elements, coords = system["elements"], system["coords"]
+	if workers is not None:
+		system["K"], system["F"], system["volume"] = parallelAssembly(elements, coords, properties, workers, chunk, mode, DOFS)
+		if symmetric:
+			system["K"] = upperTriangle(system["K"])
+		elif reduced:
+			# The parallel assembly forms the whole K, the blocks are sliced from it in the same equation order.
+			order = renumberNodes(elements, len(coords))
+			free_dof, system["Restricted_DOF"], _ = equationNumbering(len(coords), system["Restricted_DOF"], order, DOFS)
+			K = system["K"]
+			system.update(K=None, Kff=K[ix_(free_dof, free_dof)], Kfc=K[ix_(free_dof, system["Restricted_DOF"])], free_dof=free_dof)
+	elif symmetric:
+		system["K"], system["F"], system["volume"] = assembleUpper(elements, coords, properties, DOFS)
+	elif reduced:
+		(system["Kff"], system["Kfc"], system["F"], system["free_dof"], system["Restricted_DOF"],
+		 system["volume"]) = assembleReduced(elements, coords, properties, system["Restricted_DOF"], DOFS=DOFS)
+		system["K"] = None
+	else:
+		system["K"], system["F"], system["volume"] = assembleStiffness(elements, coords, properties, DOFS)
+
+	if key is not None:
+		_store(os.path.join(cache_dir, key), system)
+		evict(cache_dir, max_bytes)
+
+	return system
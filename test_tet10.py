@@ -0,0 +1,42 @@
+from tet10 import Tet10, Tet10Batch, Tet10StrainBatch
+from numpy import allclose, array, stack
+from numpy.linalg import det
+from numpy.random import default_rng
+
+# Edges of the midside nodes 5 to 10, in the node order of Tet10 (nodes 9 and 10 swapped).
+Edges = ((0, 1), (1, 2), (2, 0), (0, 3), (2, 3), (1, 3))
+
+Properties = {"E": 200e9, "nu": 0.3, "bx": 1e3, "by": -7.7e4, "bz": 5e2}
+
+def randomElements(ne, seed=0):
+	"""
+	Random valid (positively oriented) elements with slightly curved edges (nex10x3).
+	"""
+
+	rng = default_rng(seed)
+	elements = []
+	while len(elements) < ne:
+		corners = rng.uniform(-1, 1, (4, 3))
+		if det(corners[1:] - corners[0])/6 < 0.05:
+			continue
+		midside = array([(corners[a] + corners[b])/2 for a, b in Edges]) + rng.uniform(-0.02, 0.02, (6, 3))
+		elements.append(array([*corners, *midside]))
+	return stack(elements)
+
+def test_stiffness():
+	xyz = randomElements(20)
+	ke, fe, volume = Tet10Batch(xyz, Properties)
+	for i, element in enumerate(xyz):
+		ke_i, fe_i, volume_i = Tet10(element, Properties)
+		assert allclose(ke[i], ke_i, rtol=1e-10, atol=1e-12*abs(ke_i).max())
+		assert allclose(fe[i], fe_i.ravel(), rtol=1e-10, atol=1e-12*abs(fe_i).max())
+		assert allclose(volume[i], volume_i, rtol=1e-12)
+
+def test_strain():
+	xyz = randomElements(10, seed=1)
+	ue = default_rng(2).normal(0, 1e-4, (len(xyz), 30))
+	ε, σ = Tet10StrainBatch(xyz, Properties, ue)
+	for i, element in enumerate(xyz):
+		ε_i, σ_i = Tet10(element, Properties, ue[i])
+		assert allclose(ε[i], ε_i, rtol=1e-10, atol=1e-12*abs(ε_i).max())
+		assert allclose(σ[i], σ_i, rtol=1e-10, atol=1e-12*abs(σ_i).max())
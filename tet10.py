@@ -1,4 +1,4 @@
-from numpy import array, zeros 	# pip install numpy
+from numpy import array, asarray, einsum, stack, zeros 	# pip install numpy
 from scipy.linalg import det 	# pip install scipy
 
 def Tet10(xyz, properties, ue=None):
@@ -127,8 +127,7 @@ def Tet10(xyz, properties, ue=None):
 			# The determinant of the Jacobian matrix is the volume of the tetrahedron. Check Equation 17.14 (AFEM).
 			det_J = det(J)
 
-			# If the determinant is less or equal to zero, the node numbering is wrong.
-			assert det_J > 0, "The node numbering is wrong! Mapping is not invertible!"
+			# The sign of det(J) is not checked here, the elements are validated (and inverted ones reordered) by checkMesh before assembly.
 
 			# ----------------------------------------------------------------------------------------------------------------------------------------------------
 			
@@ -159,9 +158,9 @@ def Tet10(xyz, properties, ue=None):
 			# ----------------------------------------------------------------------------------------------------------------------------------------------------
 			
 			# The following values are computed to obtain the Strain-Displacement matrix. Check Equation 17.24 (AFEM).
-			qx1, qx2, qx3, qx4, qx5, qx6, qx7, qx8, qx9, qx10 = ((1/det(J)) * (dNi_dζj @ array([[a1], [a2], [a3], [a4]])).T)[0]
-			qy1, qy2, qy3, qy4, qy5, qy6, qy7, qy8, qy9, qy10 = ((1/det(J)) * (dNi_dζj @ array([[b1], [b2], [b3], [b4]])).T)[0]
-			qz1, qz2, qz3, qz4, qz5, qz6, qz7, qz8, qz9, qz10 = ((1/det(J)) * (dNi_dζj @ array([[c1], [c2], [c3], [c4]])).T)[0]
+			qx1, qx2, qx3, qx4, qx5, qx6, qx7, qx8, qx9, qx10 = ((1/det_J) * (dNi_dζj @ array([[a1], [a2], [a3], [a4]])).T)[0]
+			qy1, qy2, qy3, qy4, qy5, qy6, qy7, qy8, qy9, qy10 = ((1/det_J) * (dNi_dζj @ array([[b1], [b2], [b3], [b4]])).T)[0]
+			qz1, qz2, qz3, qz4, qz5, qz6, qz7, qz8, qz9, qz10 = ((1/det_J) * (dNi_dζj @ array([[c1], [c2], [c3], [c4]])).T)[0]
 			
 			# ----------------------------------------------------------------------------------------------------------------------------------------------------
 
@@ -271,8 +270,7 @@ def Tet10(xyz, properties, ue=None):
 			# The determinant of the Jacobian matrix is the volume of the tetrahedron. Check Equation 17.14 (AFEM).
 			det_J = det(J)
 
-			# If the determinant is less or equal to zero, the node numbering is wrong.
-			assert det_J > 0, "The node numbering is wrong! Mapping is not invertible!"
+			# The sign of det(J) is not checked here, the elements are validated (and inverted ones reordered) by checkMesh before assembly.
 
 			# ----------------------------------------------------------------------------------------------------------------------------------------------------
 			
@@ -303,9 +301,9 @@ def Tet10(xyz, properties, ue=None):
 			# ----------------------------------------------------------------------------------------------------------------------------------------------------
 			
 			# The following values are computed to obtain the Strain-Displacement matrix. Check Equation 17.24 (AFEM).
-			qx1, qx2, qx3, qx4, qx5, qx6, qx7, qx8, qx9, qx10 = ((1/det(J)) * (dNi_dζj @ array([[a1], [a2], [a3], [a4]])).T)[0]
-			qy1, qy2, qy3, qy4, qy5, qy6, qy7, qy8, qy9, qy10 = ((1/det(J)) * (dNi_dζj @ array([[b1], [b2], [b3], [b4]])).T)[0]
-			qz1, qz2, qz3, qz4, qz5, qz6, qz7, qz8, qz9, qz10 = ((1/det(J)) * (dNi_dζj @ array([[c1], [c2], [c3], [c4]])).T)[0]
+			qx1, qx2, qx3, qx4, qx5, qx6, qx7, qx8, qx9, qx10 = ((1/det_J) * (dNi_dζj @ array([[a1], [a2], [a3], [a4]])).T)[0]
+			qy1, qy2, qy3, qy4, qy5, qy6, qy7, qy8, qy9, qy10 = ((1/det_J) * (dNi_dζj @ array([[b1], [b2], [b3], [b4]])).T)[0]
+			qz1, qz2, qz3, qz4, qz5, qz6, qz7, qz8, qz9, qz10 = ((1/det_J) * (dNi_dζj @ array([[c1], [c2], [c3], [c4]])).T)[0]
 			
 			# ----------------------------------------------------------------------------------------------------------------------------------------------------
 
@@ -330,3 +328,220 @@ def Tet10(xyz, properties, ue=None):
 		
 		# Returning strain and stress components.
 		return (εe, σe)
+
+
+# ----------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Batched kernel:
+# ----------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# Gauss rule (wi, ζ1, ζ2, ζ3, ζ4), the same one used by Tet10.
+α, β = 0.58541020, 0.13819660
+Gauss_rule = ((1/4, α, β, β, β),
+			  (1/4, β, α, β, β),
+			  (1/4, β, β, α, β),
+			  (1/4, β, β, β, α))
+
+_reference_cache = {}
+
+def referenceShapeFunctions(points):
+	"""
+	Shape functions and their derivatives with respect to the natural coordinates, evaluated once for a set of points.
+
+	Inputs: points - tuple of natural coordinates (ζ1, ζ2, ζ3, ζ4).
+
+	Outputs: N - shape functions (npx10).
+			 dN - derivatives of the shape functions (npx10x4).
+
+	Note: The node ordering is the one used by Tet10 (nodes 9 and 10 swapped). Results are cached per set of points.
+	"""
+
+	points = tuple(tuple(float(ζ) for ζ in p) for p in points)
+	if points in _reference_cache:
+		return _reference_cache[points]
+
+	ζ = array(points)
+	ζ1, ζ2, ζ3, ζ4 = ζ[:, 0], ζ[:, 1], ζ[:, 2], ζ[:, 3]
+	o = zeros(len(points))
+
+	# Equation 17.2 (AFEM), with N9 and N10 swapped as in Tet10.
+	N = stack([ζ1*(2*ζ1-1), ζ2*(2*ζ2-1), ζ3*(2*ζ3-1), ζ4*(2*ζ4-1), 4*ζ1*ζ2,
+			   4*ζ2*ζ3, 4*ζ3*ζ1, 4*ζ1*ζ4, 4*ζ3*ζ4, 4*ζ2*ζ4], axis=1)
+
+	dN = stack([stack([4*ζ1 - 1, o, o, o], axis=1),
+				stack([o, 4*ζ2 - 1, o, o], axis=1),
+				stack([o, o, 4*ζ3 - 1, o], axis=1),
+				stack([o, o, o, 4*ζ4 - 1], axis=1),
+				stack([4*ζ2, 4*ζ1, o, o], axis=1),
+				stack([o, 4*ζ3, 4*ζ2, o], axis=1),
+				stack([4*ζ3, o, 4*ζ1, o], axis=1),
+				stack([4*ζ4, o, o, 4*ζ1], axis=1),
+				stack([o, o, 4*ζ4, 4*ζ3], axis=1),
+				stack([o, 4*ζ4, o, 4*ζ2], axis=1)], axis=1)
+
+	_reference_cache[points] = (N, dN)
+	return (N, dN)
+
+def elasticityMatrix(properties):
+	"""
+	Stress-strain matrix (6x6) of an isotropic material, as used by Tet10.
+	"""
+
+	E, ν = properties["E"], properties["nu"]
+	return E/((1 + ν)*(1 - 2*ν)) * array([[1 - ν, ν, ν, 0, 0, 0],
+										  [ν, 1 - ν, ν, 0, 0, 0],
+										  [ν, ν, 1 - ν, 0, 0, 0],
+										  [0, 0, 0, 1/2 - ν, 0, 0],
+										  [0, 0, 0, 0, 1/2 - ν, 0],
+										  [0, 0, 0, 0, 0, 1/2 - ν]])
+
+def jacobianDeterminant(xyz, dN):
+	"""
+	Determinant of the simplified 3x3 Jacobian (Equation 17.15, AFEM) for a stack of elements.
+
+	Inputs: xyz - array of nodal coordinates (nex10x3).
+			dN - derivatives of the shape functions (npx10x4).
+
+	Outputs: det_J - determinants (nexnp).
+	"""
+
+	# Equation 17.9 (AFEM) for every element and point at once, then Equation 17.15 (AFEM).
+	Jf = einsum("pnk,enx->epxk", dN, xyz)
+	J = Jf[..., 1:] - Jf[..., :1]
+
+	return (J[..., 0, 0]*(J[..., 1, 1]*J[..., 2, 2] - J[..., 1, 2]*J[..., 2, 1])
+		  - J[..., 0, 1]*(J[..., 1, 0]*J[..., 2, 2] - J[..., 1, 2]*J[..., 2, 0])
+		  + J[..., 0, 2]*(J[..., 1, 0]*J[..., 2, 1] - J[..., 1, 1]*J[..., 2, 0]))
+
+def shapeGradients(xyz, dN, det_J):
+	"""
+	Cartesian derivatives of the shape functions (Equation 17.24, AFEM) for a stack of elements.
+
+	Inputs: xyz - array of nodal coordinates (nex10x3).
+			dN - derivatives of the shape functions (npx10x4).
+			det_J - Jacobian determinants (nexnp).
+
+	Outputs: q - derivatives (nexnpx10x3), the last axis holds qx, qy and qz.
+	"""
+
+	x, y, z = xyz[:, :4, 0], xyz[:, :4, 1], xyz[:, :4, 2]
+	x1, x2, x3, x4 = x[:, 0], x[:, 1], x[:, 2], x[:, 3]
+	y1, y2, y3, y4 = y[:, 0], y[:, 1], y[:, 2], y[:, 3]
+	z1, z2, z3, z4 = z[:, 0], z[:, 1], z[:, 2], z[:, 3]
+
+	# Equation 16.7 (AFEM), only the corner nodes are involved.
+	a = stack([y2*(z4-z3)-y3*(z4-z2)+y4*(z3-z2), -y1*(z4-z3)+y3*(z4-z1)-y4*(z3-z1),
+			   y1*(z4-z2)-y2*(z4-z1)+y4*(z2-z1), -y1*(z3-z2)+y2*(z3-z1)-y3*(z2-z1)], axis=1)
+	b = stack([-x2*(z4-z3)+x3*(z4-z2)-x4*(z3-z2), x1*(z4-z3)-x3*(z4-z1)+x4*(z3-z1),
+			   -x1*(z4-z2)+x2*(z4-z1)-x4*(z2-z1), x1*(z3-z2)-x2*(z3-z1)+x3*(z2-z1)], axis=1)
+	c = stack([x2*(y4-y3)-x3*(y4-y2)+x4*(y3-y2), -x1*(y4-y3)+x3*(y4-y1)-x4*(y3-y1),
+			   x1*(y4-y2)-x2*(y4-y1)+x4*(y2-y1), -x1*(y3-y2)+x2*(y3-y1)-x3*(y2-y1)], axis=1)
+
+	# Equation 17.24 (AFEM).
+	return einsum("pnk,ekd->epnd", dN, stack([a, b, c], axis=2)) / det_J[..., None, None]
+
+def strainDisplacement(xyz, dN, det_J):
+	"""
+	Strain-Displacement matrices (Equation 17.23, AFEM) for a stack of elements.
+
+	Inputs: xyz - array of nodal coordinates (nex10x3).
+			dN - derivatives of the shape functions (npx10x4).
+			det_J - Jacobian determinants (nexnp).
+
+	Outputs: B - Strain-Displacement matrices (nexnpx6x30).
+	"""
+
+	return gradientsToB(shapeGradients(xyz, dN, det_J))
+
+def gradientsToB(q):
+	"""
+	Strain-Displacement matrices (Equation 17.23, AFEM) from the Cartesian derivatives of the shape functions (...x10x3).
+	"""
+
+	qx, qy, qz = q[..., 0], q[..., 1], q[..., 2]
+
+	# Equation 17.23 (AFEM).
+	B = zeros(q.shape[:-2] + (6, 30), dtype=q.dtype)
+	B[..., 0, 0::3] = qx
+	B[..., 1, 1::3] = qy
+	B[..., 2, 2::3] = qz
+	B[..., 3, 0::3], B[..., 3, 1::3] = qy, qx
+	B[..., 4, 1::3], B[..., 4, 2::3] = qz, qy
+	B[..., 5, 0::3], B[..., 5, 2::3] = qz, qx
+
+	return B
+
+def Tet10Batch(xyz, properties):
+	"""
+	Vectorized version of Tet10 that integrates a whole stack of elements at once.
+
+	Inputs: xyz - array of nodal coordinates (nex10x3).
+			properties - dictionary of material properties.
+
+	Outputs: ke - stiffness matrices (nex30x30).
+			 fe - force vectors (nex30).
+			 volume - element volumes (ne).
+
+	Note: Element validation is left to the caller, no check on the sign of det(J) is done here.
+	"""
+
+	xyz = asarray(xyz, dtype=float)
+	E_ = elasticityMatrix(properties)
+	b = array([properties["bx"], properties["by"], properties["bz"]], dtype=float)
+
+	w = array([g[0] for g in Gauss_rule])
+	N, dN = referenceShapeFunctions([g[1:] for g in Gauss_rule])
+
+	# ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+	det_J = jacobianDeterminant(xyz, dN)
+	B = strainDisplacement(xyz, dN, det_J)
+	wJ = w * det_J
+
+	# ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+	# Equation 17.25 (AFEM), the Gauss points and the strain components are stacked so that a single batched matmul does the sum.
+	ne, npts = det_J.shape
+	EB = (E_ @ B) * wJ[..., None, None]
+	ke = B.reshape(ne, npts*6, 30).transpose(0, 2, 1) @ EB.reshape(ne, npts*6, 30)
+
+	# Equation 17.27 (AFEM).
+	fe = ((wJ @ N)[:, :, None] * b).reshape(ne, 30)
+
+	return (ke, fe, wJ.sum(axis=1))
+
+# Natural coordinates of the nodes, in the same order (and with the same 9/10 swap) as in Tet10.
+Natural_coords = ((1, 0, 0, 0), (0, 1, 0, 0), (0, 0, 1, 0), (0, 0, 0, 1), (1/2, 1/2, 0, 0),
+				  (0, 1/2, 1/2, 0), (1/2, 0, 1/2, 0), (1/2, 0, 0, 1/2), (0, 1/2, 0, 1/2), (0, 0, 1/2, 1/2))
+
+def Tet10StrainBatch(xyz, properties, ue):
+	"""
+	Vectorized version of the strain/stress branch of Tet10.
+
+	Inputs: xyz - array of nodal coordinates (nex10x3).
+			properties - dictionary of material properties.
+			ue - element displacements (nex30), or (nex30xncases) for several load cases.
+
+	Outputs: εe - strains at the nodes (nex10x6[xncases]), engineering shear strains as in Tet10.
+			 σe - stresses at the nodes (nex10x6[xncases]).
+	"""
+
+	xyz = asarray(xyz, dtype=float)
+	_, dN = referenceShapeFunctions(Natural_coords)
+	q = shapeGradients(xyz, dN, jacobianDeterminant(xyz, dN))
+	εe = gradientsToStrain(q, ue)
+	σe = einsum("ij,epj...->epi...", elasticityMatrix(properties), εe)
+
+	return (εe, σe)
+
+def gradientsToStrain(q, ue):
+	"""
+	Strains (nexnpx6[xncases], engineering shear) from the shape function derivatives (nexnpx10x3) and the element
+	displacements (nex30[xncases]).
+	"""
+
+	# Displacement gradient G[..., k, c] = d(u_c)/d(x_k), the same products as B @ ue without the zeros of B.
+	ue = asarray(ue, dtype=float)
+	u = ue.reshape((len(q), 10, 3) + ue.shape[2:])
+	G = einsum("epnk,enc...->epkc...", q, u)
+	return stack([G[:, :, 0, 0], G[:, :, 1, 1], G[:, :, 2, 2],
+				  G[:, :, 1, 0] + G[:, :, 0, 1], G[:, :, 2, 1] + G[:, :, 1, 2], G[:, :, 2, 0] + G[:, :, 0, 2]], axis=2)